@@ -2,6 +2,9 @@
 ASGI config for taskmanager project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve the project through it to use the live task feed at /api/tasks/stream/,
+which holds connections open without tying up a worker thread, and the
+async read endpoints under /api/tasks/async/ (see tasks/async_views.py).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
@@ -0,0 +1,499 @@
+"""
+Project-wide middleware for taskmanager.
+"""
+
+import cProfile
+import hmac
+import json
+import logging
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from contextlib import ExitStack
+from datetime import datetime
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:  # Optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class GzipStream:
+    """Incremental gzip compressor."""
+
+    encoding = 'gzip'
+
+    def __init__(self, level=6):
+        # wbits=31 selects the gzip container
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data, flush=True):
+        chunk = self._compressor.compress(data)
+        if flush:
+            # Sync flush so each chunk can be decoded as soon as it arrives
+            chunk += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return chunk
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliStream:
+    """Incremental brotli compressor (requires the brotli package)."""
+
+    encoding = 'br'
+
+    def __init__(self, level=4):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data, flush=True):
+        chunk = self._compressor.process(data)
+        if flush:
+            chunk += self._compressor.flush()
+        return chunk
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ZstdStream:
+    """Incremental zstd compressor (requires the zstandard package)."""
+
+    encoding = 'zstd'
+
+    def __init__(self, level=3):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data, flush=True):
+        chunk = self._compressor.compress(data)
+        if flush:
+            chunk += self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return chunk
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+def available_streams():
+    """Return the compressors usable in this environment, keyed by encoding."""
+    streams = {'gzip': GzipStream}
+    if brotli is not None:
+        streams['br'] = BrotliStream
+    if zstandard is not None:
+        streams['zstd'] = ZstdStream
+    return streams
+
+
+def parse_accept_encoding(header):
+    """Return a mapping of content-coding to q-value from an Accept-Encoding header."""
+    accepted = {}
+    for item in header.split(','):
+        parts = [part.strip() for part in item.split(';')]
+        coding = parts[0].lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            match = re.fullmatch(r'q=([0-9.]+)', param)
+            if match:
+                try:
+                    quality = float(match.group(1))
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compress responses with the best encoding the client accepts.
+
+    Encodings are tried in the order of settings.COMPRESSION_ENCODINGS
+    (zstd and br are only used when their libraries are installed, gzip
+    is always available). Only the media types in
+    settings.COMPRESSION_CONTENT_TYPES are compressed: HTML pages (the
+    admin, the browsable API) embed CSRF tokens next to reflected input,
+    which compression would expose to BREACH-style length attacks, so
+    they are left alone. Responses smaller than
+    settings.COMPRESSION_MIN_SIZE bytes are sent as-is. Streaming
+    responses are compressed chunk by chunk and flushed after each chunk,
+    so they keep streaming.
+
+    The compression ratio and CPU time of every compressed response are
+    logged to the "taskmanager.middleware" logger, and added as a
+    Server-Timing entry for non-streaming responses.
+    """
+
+    default_encodings = ['zstd', 'br', 'gzip']
+    default_min_size = 1024
+    default_content_types = ['application/json', 'text/event-stream']
+
+    def select_stream(self, request):
+        """Return the compressor class to use for this request, or None."""
+        accepted = parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        streams = available_streams()
+
+        for encoding in getattr(settings, 'COMPRESSION_ENCODINGS', self.default_encodings):
+            if encoding not in streams:
+                continue
+            quality = accepted.get(encoding, accepted.get('*', 0.0))
+            if quality > 0:
+                return streams[encoding]
+        return None
+
+    def process_response(self, request, response):
+        min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', self.default_min_size)
+
+        # Already encoded, or the sender asked intermediaries not to transform it
+        if response.has_header('Content-Encoding'):
+            return response
+        if 'no-transform' in response.get('Cache-Control', ''):
+            return response
+
+        media_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if media_type not in getattr(settings, 'COMPRESSION_CONTENT_TYPES', self.default_content_types):
+            return response
+
+        if response.streaming:
+            # Streaming responses only know their size if they declare it
+            content_length = response.get('Content-Length')
+            if content_length and content_length.isdigit() and int(content_length) < min_size:
+                return response
+        elif len(response.content) < min_size:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        stream_class = self.select_stream(request)
+        if stream_class is None:
+            return response
+
+        if response.streaming:
+            self._compress_streaming(request, response, stream_class)
+        else:
+            original_size = len(response.content)
+            started = time.thread_time()
+            stream = stream_class()
+            compressed = stream.compress(response.content, flush=False) + stream.finish()
+            cpu_time = time.thread_time() - started
+
+            # Not worth it, send the original
+            if len(compressed) >= original_size:
+                return response
+
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+            ratio = self._record(request, stream.encoding, original_size, len(compressed), cpu_time)
+            self._add_server_timing(response, stream.encoding, ratio, cpu_time)
+
+        # Compressed bytes differ from the original, so strong ETags no longer apply
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = stream_class.encoding
+        return response
+
+    def _compress_streaming(self, request, response, stream_class):
+        """Wrap streaming_content in an incremental compressor."""
+        original_content = response.streaming_content
+        stream = stream_class()
+        stats = {'original': 0, 'compressed': 0, 'cpu': 0.0}
+
+        def compress(chunk, final=False):
+            started = time.thread_time()
+            data = stream.finish() if final else stream.compress(chunk)
+            stats['cpu'] += time.thread_time() - started
+            stats['original'] += len(chunk)
+            stats['compressed'] += len(data)
+            return data
+
+        def record():
+            self._record(request, stream.encoding, stats['original'], stats['compressed'], stats['cpu'])
+
+        if response.is_async:
+            async def compressed_content():
+                try:
+                    async for chunk in original_content:
+                        data = compress(chunk)
+                        if data:
+                            yield data
+                    yield compress(b'', final=True)
+                finally:
+                    record()
+        else:
+            def compressed_content():
+                try:
+                    for chunk in original_content:
+                        data = compress(chunk)
+                        if data:
+                            yield data
+                    yield compress(b'', final=True)
+                finally:
+                    record()
+
+        response.streaming_content = compressed_content()
+        del response.headers['Content-Length']
+
+    def _record(self, request, encoding, original_size, compressed_size, cpu_time):
+        """Log the compression ratio and CPU time, returning the ratio."""
+        ratio = original_size / compressed_size if compressed_size else 0.0
+        logger.debug(
+            "Compressed %s with %s: %d -> %d bytes (ratio %.2f, cpu %.3f ms)",
+            request.path, encoding, original_size, compressed_size, ratio, cpu_time * 1000,
+            extra={
+                'encoding': encoding,
+                'original_size': original_size,
+                'compressed_size': compressed_size,
+                'compression_ratio': ratio,
+                'cpu_time': cpu_time,
+            },
+        )
+        return ratio
+
+    def _add_server_timing(self, response, encoding, ratio, cpu_time):
+        entry = f'compress;dur={cpu_time * 1000:.3f};desc="{encoding} x{ratio:.2f}"'
+        existing = response.get('Server-Timing')
+        response.headers['Server-Timing'] = f'{existing}, {entry}' if existing else entry
+
+
+class RequestCapture:
+    """cProfile data and SQL timings collected for one request."""
+
+    # cProfile cannot run two profilers in the same thread, so a request
+    # overlapping an active profile (concurrent async views) records SQL only
+    _local = threading.local()
+
+    def __init__(self):
+        self.queries = []
+        self.profiler = None
+        # Profile of a sync view run in a sync_to_async thread (ASGI only)
+        self.view_profiler = None
+        self.duration = None
+        self._wrappers = None
+        self._started = None
+
+    def _record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'duration': time.perf_counter() - started,
+            })
+
+    def watch_queries(self):
+        """Time queries run from the calling thread on every database."""
+        self._wrappers = ExitStack()
+        for connection in connections.all():
+            self._wrappers.enter_context(connection.execute_wrapper(self._record_query))
+
+    def unwatch_queries(self):
+        self._wrappers.close()
+
+    @property
+    def profiled(self):
+        return self.profiler is not None or self.view_profiler is not None
+
+    def _enable_profiler(self):
+        """Start a profiler in the calling thread, or return None if one is running there."""
+        if getattr(self._local, 'active', False):
+            return None
+        self._local.active = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _disable_profiler(self, profiler):
+        if profiler is not None:
+            profiler.disable()
+            self._local.active = False
+
+    def start(self):
+        self.profiler = self._enable_profiler()
+        self._started = time.perf_counter()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self._started
+        self._disable_profiler(self.profiler)
+
+    def start_view(self):
+        """Profile the calling thread, which is about to run the view."""
+        self.view_profiler = self._enable_profiler()
+
+    def stop_view(self):
+        self._disable_profiler(self.view_profiler)
+
+    def dump_stats(self, path):
+        """Write the profiles of all threads as one pstats file."""
+        profilers = [profiler for profiler in (self.profiler, self.view_profiler) if profiler is not None]
+        pstats.Stats(*profilers).dump_stats(path)
+
+
+class ProfilingMiddleware:
+    """
+    Profile selected requests with cProfile and record their SQL timings.
+
+    A request is profiled when:
+    - it is picked at random, for a fraction of
+      settings.PROFILING_SAMPLE_RATE of all requests, or
+    - it sends the settings.PROFILING_HEADER header with
+      settings.PROFILING_TOKEN as its value (operators only, the header
+      is ignored while no token is configured)
+
+    Each capture is written to settings.PROFILING_DIR as a pair of files
+    named after the view and action, e.g.
+    20261018T120000123456-TaskViewSet.list-1a2b3c4d.prof (pstats data) and
+    .json (request details and every query with its duration). Only the
+    newest settings.PROFILING_MAX_CAPTURES captures are kept. The capture
+    name is returned in the X-Profile-Id response header.
+
+    Summarize captures with `manage.py summarize_profiles`.
+
+    Under WSGI, cProfile covers the request's thread. Under ASGI it runs
+    on the event loop thread, which covers the middleware and async views,
+    and process_view() starts a second profiler in the sync_to_async
+    thread a sync view runs in (DRF viewsets included). Both go into the
+    one .prof file. Work that async views hand to sync_to_async threads
+    (such as ORM calls) shows up in the SQL timings only. Other requests
+    served by the event loop meanwhile do show up in the loop's profile.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    default_header = 'X-Profile'
+    default_max_captures = 200
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        capture = RequestCapture()
+        capture.watch_queries()
+        capture.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            capture.stop()
+            capture.unwatch_queries()
+        return self.save_capture(request, response, capture)
+
+    async def __acall__(self, request):
+        if not self.should_profile(request):
+            return await self.get_response(request)
+
+        # ORM calls and sync views run in the request's sync_to_async
+        # thread, so the query timers are installed there
+        capture = RequestCapture()
+        await sync_to_async(capture.watch_queries)()
+        request._profiling_capture = capture
+        capture.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            capture.stop()
+            await sync_to_async(capture.stop_view)()
+            await sync_to_async(capture.unwatch_queries)()
+        return await sync_to_async(self.save_capture)(request, response, capture)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Under ASGI this runs in the thread that runs a sync view next
+        capture = getattr(request, '_profiling_capture', None)
+        if capture is not None and not iscoroutinefunction(view_func):
+            capture.start_view()
+
+    def should_profile(self, request):
+        token = getattr(settings, 'PROFILING_TOKEN', '')
+        if token:
+            header = getattr(settings, 'PROFILING_HEADER', self.default_header)
+            value = request.headers.get(header, '')
+            if value and hmac.compare_digest(value.encode(), token.encode()):
+                return True
+
+        rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+        return rate > 0 and random.random() < rate
+
+    def save_capture(self, request, response, capture):
+        """Write the capture to disk and name it in the response."""
+        try:
+            name = self._write_capture(request, response, capture)
+        except OSError:
+            logger.exception("Could not write the profile of %s", request.path)
+        else:
+            response.headers['X-Profile-Id'] = name
+        return response
+
+    def _view_name(self, request):
+        """Return 'ViewSet.action' for the resolved view, or its URL name."""
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return 'unresolved'
+
+        view_class = getattr(match.func, 'cls', None)
+        actions = getattr(match.func, 'actions', None) or {}
+        if view_class is not None:
+            action = actions.get(request.method.lower(), request.method.lower())
+            return f'{view_class.__name__}.{action}'
+        return match.url_name or match.func.__name__
+
+    def _write_capture(self, request, response, capture):
+        directory = Path(getattr(settings, 'PROFILING_DIR', settings.BASE_DIR / 'profiles'))
+        directory.mkdir(parents=True, exist_ok=True)
+
+        view = re.sub(r'[^\w.]', '_', self._view_name(request))
+        name = f'{datetime.now().strftime("%Y%m%dT%H%M%S%f")}-{view}-{uuid.uuid4().hex[:8]}'
+
+        if capture.profiled:
+            capture.dump_stats(directory / f'{name}.prof')
+
+        details = {
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration': capture.duration,
+            'profiled': capture.profiled,
+            'queries': capture.queries,
+        }
+        (directory / f'{name}.json').write_text(json.dumps(details))
+
+        self._rotate(directory)
+        return name
+
+    def _rotate(self, directory):
+        """Delete the oldest captures beyond PROFILING_MAX_CAPTURES."""
+        keep = getattr(settings, 'PROFILING_MAX_CAPTURES', self.default_max_captures)
+        # Names start with a timestamp, so they sort oldest first
+        captures = sorted(directory.glob('*.json'))
+        for details in captures[:max(0, len(captures) - keep)]:
+            details.with_suffix('.prof').unlink(missing_ok=True)
+            details.unlink(missing_ok=True)
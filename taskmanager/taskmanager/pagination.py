@@ -0,0 +1,58 @@
+"""
+Pagination helpers for large tables.
+"""
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class ApproximateCountPaginator(Paginator):
+    """
+    Paginator that avoids an unbounded COUNT(*) on large tables.
+
+    - Unfiltered querysets use the database's row estimate (PostgreSQL
+      statistics, or the highest rowid on SQLite)
+    - Filtered querysets are counted exactly, but only up to count_limit
+      rows, so the count is cut off instead of scanning every match
+
+    Meant for admin changelists (together with show_full_result_count =
+    False), where an approximate page count is acceptable.
+    """
+
+    # Filtered counts stop after this many rows
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self._estimate_rows(queryset)
+            # Small tables are cheap to count exactly
+            if estimate is not None and estimate > self.count_limit:
+                return estimate
+
+        return queryset.order_by()[:self.count_limit].count()
+
+    def _estimate_rows(self, queryset):
+        """Return the estimated number of rows in the queryset's table, or None."""
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [connection.ops.quote_name(table)]
+                )
+            elif connection.vendor == 'sqlite':
+                # Upper bound read from the end of the rowid b-tree
+                cursor.execute(f"SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}")
+            else:
+                return None
+            row = cursor.fetchone()
+
+        # reltuples is -1 for tables that were never analyzed
+        if not row or row[0] is None or row[0] < 0:
+            return None
+        return row[0]
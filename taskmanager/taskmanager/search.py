@@ -0,0 +1,37 @@
+"""
+Admin search helpers for large tables.
+"""
+
+from django.db.models import Q
+
+# Sorts after every character a search term is followed by in practice,
+# so term <= value < term + PREFIX_END holds for the values starting with term
+PREFIX_END = '\uffff'
+
+
+class PrefixSearchMixin:
+    """
+    ModelAdmin mixin that matches search terms as prefixes of the
+    search_fields, with lookups an index can serve.
+
+    Django's admin search compiles every field to LIKE '%term%' (or
+    LIKE 'term%' for '^' fields) with an ESCAPE clause, case-insensitive,
+    which no ordinary index serves, so each search scans the table. Here
+    the whole search term is matched as a case-sensitive prefix instead,
+    expressed as a range (field >= term AND field < term + PREFIX_END).
+    Each field needs an index it leads; the fields are ORed, which SQLite
+    and PostgreSQL answer with one index range per field.
+
+    Also applies to autocomplete lookups against the admin.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+
+        condition = Q()
+        for field in self.get_search_fields(request):
+            name = field.lstrip('^=@')
+            condition |= Q(**{f'{name}__gte': term, f'{name}__lt': term + PREFIX_END})
+        return queryset.filter(condition), False
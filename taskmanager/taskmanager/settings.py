@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -39,11 +40,14 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'tasks',
     'rest_framework',
+    'rest_framework.authtoken',
     'users',
 ]
 
 MIDDLEWARE = [
+    'taskmanager.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'taskmanager.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -72,6 +76,58 @@ TEMPLATES = [
 WSGI_APPLICATION = 'taskmanager.wsgi.application'
 
 
+# Response compression (taskmanager.middleware.CompressionMiddleware)
+# Encodings in order of preference; zstd and br need the zstandard and
+# brotli packages and are skipped when those are not installed.
+
+COMPRESSION_ENCODINGS = ['zstd', 'br', 'gzip']
+
+# Responses smaller than this many bytes are not compressed
+COMPRESSION_MIN_SIZE = 1024
+
+# Media types that are compressed. Keep HTML out: pages carrying CSRF
+# tokens leak them through compressed lengths (BREACH)
+COMPRESSION_CONTENT_TYPES = ['application/json', 'text/event-stream']
+
+
+# Request profiling (taskmanager.middleware.ProfilingMiddleware)
+# Fraction of requests profiled at random; 0 disables sampling
+
+PROFILING_SAMPLE_RATE = 0.0
+
+# Requests sending this header with PROFILING_TOKEN as its value are
+# always profiled. The header is ignored while the token is empty.
+PROFILING_HEADER = 'X-Profile'
+PROFILING_TOKEN = ''
+
+# Captures are written here; only the newest PROFILING_MAX_CAPTURES are kept
+PROFILING_DIR = BASE_DIR / 'profiles'
+PROFILING_MAX_CAPTURES = 200
+
+
+# Live task feed (tasks.events / tasks.streams)
+# Backend that carries change events to subscribers
+
+TASK_EVENTS_BACKEND = 'tasks.events.LocalBackend'
+
+# Recent events kept per user for resuming with Last-Event-ID
+TASK_EVENTS_BUFFER_SIZE = 1000
+
+# Users whose recent events are kept; the least recently active user's
+# buffer is dropped beyond this, and their clients refetch on resume
+TASK_EVENTS_MAX_USERS = 10000
+
+# Events queued per connection before a slow client is disconnected
+TASK_EVENTS_QUEUE_SIZE = 100
+
+# Seconds between heartbeats on an idle stream
+TASK_EVENTS_HEARTBEAT = 15
+
+# Tasks a move may change (the subtree and both ancestor chains) before it
+# is announced as a reset rather than one event per task
+TASK_EVENTS_MOVE_LIMIT = 100
+
+
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
@@ -82,6 +138,36 @@ DATABASES = {
     }
 }
 
+# A second database for the sharding tests (tasks.tests), which list it in
+# TASK_SHARDS themselves. The test runner keeps it in memory.
+if sys.argv[1:2] == ['test']:
+    DATABASES['other'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_other.sqlite3',
+    }
+
+# Databases holding the tasks app tables (Task, Category). Each user's
+# rows live on one of them; users, tokens and everything else stay on
+# 'default'. To shard, add more aliases to DATABASES and list them here,
+# then run `manage.py migrate --database=<alias>` for each.
+TASK_SHARDS = ['default']
+
+# Cache holding the user -> shard assignments. With several worker
+# processes use a cache they all share, so that moving a user
+# (rebalance_user) takes effect in every process at once
+TASK_SHARD_CACHE = 'default'
+
+DATABASE_ROUTERS = ['tasks.routers.TaskShardRouter']
+
+
+# Custom user model used for registration, login and task ownership.
+# Changing it changes the schema of every table referencing users:
+# databases created while auth.User was the user model (including
+# db.sqlite3 files from before this setting) must be recreated, e.g.
+# delete the file and run `manage.py migrate` again
+
+AUTH_USER_MODEL = 'users.CustomUser'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -122,4 +208,5 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 # Default primary key field type
-# https://docs.djangoproject.com/en/6.0/ref/settings/#default-auto-field
\ No newline at end of file
+# https://docs.djangoproject.com/en/6.0/ref/settings/#default-auto-field
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -0,0 +1,118 @@
+"""
+Test helpers for enforcing per-route query budgets.
+"""
+
+import re
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+# Matches the table or index named in an EXPLAIN QUERY PLAN detail line
+PLAN_TABLE = re.compile(r'^(?:SCAN|SEARCH) (\S+)')
+PLAN_INDEX = re.compile(r'USING (?:COVERING )?INDEX (\S+) \((.*)\)')
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin asserting how much database work a block of code does.
+
+        with self.assertQueryBudget(queries=1, rows=600):
+            self.client.get(url)
+
+    queries is the maximum number of queries executed. rows is the maximum
+    number of rows the query plans scan in total, estimated from SQLite's
+    EXPLAIN QUERY PLAN and ANALYZE statistics (call analyze_database()
+    after seeding). Each table access in a plan is counted once: a full
+    table scan counts every row of the table, an index search counts the
+    average number of rows per searched key.
+
+    On failure the message lists every query with its plan.
+    """
+
+    @classmethod
+    def analyze_database(cls):
+        """Refresh the planner statistics used for row estimates."""
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    @contextmanager
+    def assertQueryBudget(self, queries, rows=None):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+
+        executed = context.captured_queries
+        report = [self._explain(query['sql']) for query in executed]
+        scanned = sum(rows_scanned for sql, plan, rows_scanned in report)
+
+        problems = []
+        if len(executed) > queries:
+            problems.append(f"{len(executed)} queries executed, budget is {queries}")
+        if rows is not None and connection.vendor == 'sqlite' and scanned > rows:
+            problems.append(f"~{scanned} rows scanned, budget is {rows}")
+
+        if problems:
+            details = '\n\n'.join(
+                f"{number}. {sql}\n" + '\n'.join(f"   {line}" for line in plan) + f"\n   (~{rows_scanned} rows)"
+                for number, (sql, plan, rows_scanned) in enumerate(report, start=1)
+            )
+            self.fail('; '.join(problems) + '\n\n' + details)
+
+    def _explain(self, sql):
+        """Return (sql, plan lines, estimated rows scanned) for a captured query."""
+        if connection.vendor != 'sqlite' or not sql.lstrip().upper().startswith('SELECT'):
+            return sql, [], 0
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = [row[-1] for row in cursor.fetchall()]
+
+        return sql, plan, sum(self._rows_for_step(step) for step in plan)
+
+    def _rows_for_step(self, step):
+        """Estimate the rows read by one EXPLAIN QUERY PLAN step."""
+        match = PLAN_TABLE.match(step)
+        if match is None:
+            # Sorting, temp b-trees, compound query markers
+            return 0
+
+        table = match.group(1)
+        if table not in connection.introspection.table_names():
+            # Subquery or alias, its own steps are counted separately
+            return 0
+
+        if step.startswith('SCAN') or 'AUTOMATIC' in step:
+            return self._table_rows(table)
+
+        if 'INTEGER PRIMARY KEY' in step or ('PRIMARY KEY' in step and '=' in step):
+            return 1
+
+        index = PLAN_INDEX.search(step)
+        if index is None:
+            return self._table_rows(table)
+
+        # Rows per key for the number of leading columns matched by equality
+        equalities = len(re.findall(r'\w+=\?', index.group(2)))
+        return self._rows_per_key(table, index.group(1), equalities)
+
+    def _table_rows(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+            return cursor.fetchone()[0]
+
+    def _rows_per_key(self, table, index, equalities):
+        """Average rows matching the first `equalities` columns of an index."""
+        row = None
+        with connection.cursor() as cursor:
+            # The statistics table only exists once ANALYZE has run
+            if 'sqlite_stat1' in connection.introspection.table_names(cursor):
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s AND idx = %s', [table, index])
+                row = cursor.fetchone()
+
+        if row is None:
+            return self._table_rows(table)
+
+        # "<rows in index> <rows per 1st column value> <rows per 1st+2nd> ..."
+        stats = [int(value) for value in row[0].split() if value.isdigit()]
+        return stats[min(equalities, len(stats) - 1)]
@@ -0,0 +1,179 @@
+import gzip
+import json
+import pstats
+import tempfile
+import zlib
+from io import StringIO
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from tasks.models import Task
+from .middleware import CompressionMiddleware
+
+TOKEN = 'profiling-token'
+# Compressible JSON payload above COMPRESSION_MIN_SIZE
+PAYLOAD = {'tasks': [{'id': i, 'title': f'Task {i}', 'status': 'pending'} for i in range(100)]}
+
+
+@override_settings(COMPRESSION_ENCODINGS=['gzip'], COMPRESSION_MIN_SIZE=1024)
+class CompressionMiddlewareTests(SimpleTestCase):
+    """Encoding negotiation, size and content-type limits, and streaming in CompressionMiddleware."""
+
+    def compress(self, response, accept_encoding='gzip'):
+        request = RequestFactory().get('/api/tasks/tasks/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_gzip(self):
+        original = JsonResponse(PAYLOAD)
+        body = original.content
+        response = self.compress(original)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), body)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+
+    def test_negotiation(self):
+        for accept_encoding, encoded in [
+            ('', False),
+            ('identity', False),
+            ('gzip;q=0', False),
+            ('br, GZIP;q=0.5', True),
+            ('*', True),
+            ('*, gzip;q=0', False),
+        ]:
+            with self.subTest(accept_encoding=accept_encoding):
+                response = self.compress(JsonResponse(PAYLOAD), accept_encoding)
+                self.assertEqual(response.has_header('Content-Encoding'), encoded)
+
+    def test_unavailable_encoding_falls_back(self):
+        with override_settings(COMPRESSION_ENCODINGS=['unknown', 'gzip']):
+            response = self.compress(JsonResponse(PAYLOAD), 'unknown, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_size_threshold(self):
+        response = self.compress(JsonResponse({'id': 1}))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        with override_settings(COMPRESSION_MIN_SIZE=0):
+            response = self.compress(JsonResponse({'id': 1, 'title': 'x' * 100}))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_html_is_not_compressed(self):
+        # Pages with CSRF tokens would be open to BREACH
+        response = self.compress(HttpResponse('<input name="csrfmiddlewaretoken">' * 100))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_already_encoded_or_no_transform(self):
+        response = JsonResponse(PAYLOAD)
+        response['Cache-Control'] = 'no-transform'
+        self.assertFalse(self.compress(response).has_header('Content-Encoding'))
+
+        response = JsonResponse(PAYLOAD)
+        response['Content-Encoding'] = 'br'
+        self.assertEqual(self.compress(response)['Content-Encoding'], 'br')
+
+    def test_strong_etag_is_weakened(self):
+        response = JsonResponse(PAYLOAD)
+        response['ETag'] = '"abc"'
+        self.assertEqual(self.compress(response)['ETag'], 'W/"abc"')
+
+    def test_streaming(self):
+        chunks = [b'data: {"id": %d}\n\n' % i for i in range(3)]
+        original = StreamingHttpResponse(iter(chunks), content_type='text/event-stream')
+        response = self.compress(original)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+
+        # Each chunk is flushed, so it decodes as soon as it arrives
+        decompressor = zlib.decompressobj(31)
+        received = [decompressor.decompress(chunk) for chunk in response.streaming_content]
+        self.assertEqual(received[:len(chunks)], chunks)
+        self.assertEqual(b''.join(received) + decompressor.flush(), b''.join(chunks))
+
+    def test_small_streaming_response(self):
+        original = StreamingHttpResponse(iter([b'{}']), content_type='application/json')
+        original['Content-Length'] = '2'
+        self.assertFalse(self.compress(original).has_header('Content-Encoding'))
+
+
+class ProfilingMiddlewareTests(TestCase):
+    """Request capture by ProfilingMiddleware and the summarize_profiles command."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            username='operator', email='operator@example.com', password='pass12345'
+        )
+        Task.objects.create(title='Profiled task', user=cls.user)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+        settings = override_settings(PROFILING_DIR=self.directory, PROFILING_TOKEN=TOKEN, PROFILING_MAX_CAPTURES=2)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_not_profiled_by_default(self):
+        response = self.client.get('/api/tasks/tasks/')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(any(self.directory.iterdir()))
+
+    def test_wrong_token_is_ignored(self):
+        response = self.client.get('/api/tasks/tasks/', HTTP_X_PROFILE='guess')
+        self.assertNotIn('X-Profile-Id', response)
+
+    def test_capture(self):
+        response = self.client.get('/api/tasks/tasks/', HTTP_X_PROFILE=TOKEN)
+        self.assertEqual(response.status_code, 200)
+
+        name = response['X-Profile-Id']
+        self.assertIn('TaskViewSet.list', name)
+        self.assertTrue((self.directory / f'{name}.prof').exists())
+
+        details = json.loads((self.directory / f'{name}.json').read_text())
+        self.assertEqual(details['view'], 'TaskViewSet.list')
+        self.assertTrue(any('tasks_task' in query['sql'] for query in details['queries']))
+
+    async def test_asgi_capture(self):
+        # The viewset is sync: it runs in a sync_to_async thread, not on the event loop
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get('/api/tasks/tasks/', headers={'X-Profile': TOKEN})
+        self.assertEqual(response.status_code, 200)
+
+        stats = pstats.Stats(str(self.directory / f"{response['X-Profile-Id']}.prof"))
+        functions = {function for _, _, function in stats.stats}
+        self.assertIn('dispatch', functions)
+        self.assertIn('get_queryset', functions)
+
+    @override_settings(PROFILING_TOKEN='', PROFILING_SAMPLE_RATE=1.0)
+    def test_sampling(self):
+        response = self.client.get('/api/tasks/categories/')
+        self.assertIn('CategoryViewSet.list', response['X-Profile-Id'])
+
+    def test_rotation(self):
+        for _ in range(3):
+            self.client.get('/api/tasks/tasks/', HTTP_X_PROFILE=TOKEN)
+        self.assertEqual(len(list(self.directory.glob('*.json'))), 2)
+        self.assertEqual(len(list(self.directory.glob('*.prof'))), 2)
+
+    def test_summarize_profiles(self):
+        self.client.get('/api/tasks/tasks/', HTTP_X_PROFILE=TOKEN)
+        self.client.get('/api/tasks/tasks/dashboard/', HTTP_X_PROFILE=TOKEN)
+
+        output = StringIO()
+        call_command('summarize_profiles', view='TaskViewSet', stdout=output)
+        summary = output.getvalue()
+        self.assertIn('2 capture(s)', summary)
+        self.assertIn('TaskViewSet.dashboard', summary)
+        self.assertIn('ncalls', summary)
+        self.assertIn('tasks_task', summary)
@@ -1,6 +1,228 @@
-from django.contrib import admin
+from urllib.parse import urlencode
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.db import transaction
+from django.http import QueryDict
+from django.utils import timezone
+
+from taskmanager.pagination import ApproximateCountPaginator
+from taskmanager.search import PrefixSearchMixin
+from .events import publish_reset
 from .models import Task, Category
+from .sharding import get_shards, pin_shard, shard_for_user
 # Register your models here.
 
-admin.site.register(Task)
-admin.site.register(Category)
\ No newline at end of file
+
+class ShardListFilter(admin.SimpleListFilter):
+    """Pick the shard a changelist reads (see ShardedModelAdmin); hidden when unsharded"""
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in get_shards()]
+
+    def has_output(self):
+        return len(get_shards()) > 1
+
+    def queryset(self, request, queryset):
+        # ShardedModelAdmin.get_queryset() already reads from the shard
+        return queryset
+
+    def choices(self, changelist):
+        # One shard is always selected, so there is no "All" choice
+        selected = self.value() or get_shards()[0]
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': lookup == selected,
+                'query_string': changelist.get_query_string({self.parameter_name: lookup}),
+                'display': title,
+            }
+
+
+class ShardAutocompleteSelect(AutocompleteSelect):
+    """Autocomplete widget whose lookups search the shard of the form"""
+
+    def get_url(self):
+        return f'{super().get_url()}?{urlencode({ShardListFilter.parameter_name: self.db})}'
+
+
+class ShardedModelForm(forms.ModelForm):
+    """Admin form that keeps a row on the shard of its owner"""
+
+    # Set per request by ShardedModelAdmin.get_form()
+    shard = None
+
+    def clean(self):
+        cleaned_data = super().clean()
+        user = cleaned_data.get('user')
+        if user is not None and self.shard is not None:
+            user_shard = shard_for_user(user.pk)
+            if user_shard != self.shard:
+                raise forms.ValidationError(
+                    f"{user}'s rows are stored on shard '{user_shard}'. Select that "
+                    f"shard in the list filter before adding or editing them."
+                )
+        return cleaned_data
+
+
+class ShardedModelAdmin(admin.ModelAdmin):
+    """
+    Admin for models stored on the user shards (see tasks.sharding).
+
+    A changelist shows one shard at a time, picked with the shard filter
+    (the first shard by default). Change and delete pages, actions and
+    autocomplete lookups reached from it work on the same shard; Django
+    code that queries without a hint (unique checks, the deletion
+    summary) is pinned to it. Users live on the global database, so
+    they are prefetched rather than joined.
+    """
+    form = ShardedModelForm
+    # Foreign keys to other sharded models, read from the same shard
+    sharded_relations = []
+
+    def get_shard(self, request):
+        """Return the shard selected in the changelist filter."""
+        shards = get_shards()
+        shard = request.GET.get(ShardListFilter.parameter_name)
+        if shard is None:
+            # Change pages carry the changelist filters along
+            preserved = QueryDict(request.GET.get('_changelist_filters', ''))
+            shard = preserved.get(ShardListFilter.parameter_name)
+        return shard if shard in shards else shards[0]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).using(self.get_shard(request))
+
+    def get_list_filter(self, request):
+        return [ShardListFilter, *super().get_list_filter(request)]
+
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        form.shard = self.get_shard(request)
+        return form
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name in self.sharded_relations:
+            kwargs['using'] = shard = self.get_shard(request)
+            if db_field.name in self.get_autocomplete_fields(request):
+                kwargs['widget'] = ShardAutocompleteSelect(db_field, self.admin_site, using=shard)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def changelist_view(self, request, extra_context=None):
+        with pin_shard(self.get_shard(request)):
+            return super().changelist_view(request, extra_context)
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        with pin_shard(self.get_shard(request)):
+            return super().changeform_view(request, object_id, form_url, extra_context)
+
+    def delete_view(self, request, object_id, extra_context=None):
+        with pin_shard(self.get_shard(request)):
+            return super().delete_view(request, object_id, extra_context)
+
+
+class ArchivedListFilter(admin.SimpleListFilter):
+    """Filter tasks by whether they have been archived"""
+    title = 'archived'
+    parameter_name = 'archived'
+
+    def lookups(self, request, model_admin):
+        return [('yes', 'Yes'), ('no', 'No')]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.filter(archived_at__isnull=False)
+        if self.value() == 'no':
+            return queryset.filter(archived_at__isnull=True)
+        return queryset
+
+
+@admin.register(Task)
+class TaskAdmin(PrefixSearchMixin, ShardedModelAdmin):
+    """
+    Task admin built for large tables:
+    - category is joined into the changelist query, owners are prefetched
+    - counts are approximate (no unbounded COUNT(*))
+    - user, category and parent are picked with autocomplete instead of full dropdowns
+    - search matches title prefixes on an index, also for the parent autocomplete
+    - bulk actions run a constant number of queries
+    """
+    list_display = ['title', 'user', 'category', 'status', 'priority', 'due_date', 'archived_at']
+    list_select_related = ['category']
+    list_filter = ['status', 'priority', ArchivedListFilter]
+    date_hierarchy = 'due_date'
+    search_fields = ['title']
+    autocomplete_fields = ['user', 'category', 'parent']
+    sharded_relations = ['category', 'parent']
+    readonly_fields = ['created_at', 'updated_at', 'completed_at', 'archived_at']
+    # Primary key order needs no sort over the whole table
+    ordering = ['-id']
+
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+
+    actions = ['mark_completed', 'archive']
+
+    def get_queryset(self, request):
+        # category__user is needed by Category.__str__
+        return super().get_queryset(request).prefetch_related('user', 'category__user')
+
+    def announce_changes(self, user_ids, using):
+        """Tell the owners' live feed clients to refetch once the bulk update commits."""
+        def publish():
+            for user_id in user_ids:
+                publish_reset(user_id)
+        transaction.on_commit(publish, using=using)
+
+    @admin.action(description="Mark selected tasks as completed")
+    def mark_completed(self, request, queryset):
+        now = timezone.now()
+        pending = queryset.filter(status='pending')
+        with transaction.atomic(using=queryset.db):
+            rows = list(pending.values_list('path', 'user_id'))
+            updated = pending.update(status='completed', completed_at=now, updated_at=now)
+            # Bulk updates bypass save() and its events, so roll the
+            # completions up and announce them here
+            Task.adjust_completed_counts([path for path, _ in rows], 1, using=queryset.db)
+            self.announce_changes({user_id for _, user_id in rows}, queryset.db)
+        self.message_user(request, f"{updated} task(s) marked as completed.", messages.SUCCESS)
+
+    def delete_queryset(self, request, queryset):
+        # Task.delete() takes the subtasks along and updates the rollups;
+        # path order puts parents first so their subtasks are skipped
+        deleted_paths = []
+        for task in queryset.order_by('path'):
+            if not any(task.path.startswith(path) for path in deleted_paths):
+                task.delete()
+                deleted_paths.append(task.path)
+
+    @admin.action(description="Archive selected tasks")
+    def archive(self, request, queryset):
+        now = timezone.now()
+        unarchived = queryset.filter(archived_at__isnull=True)
+        with transaction.atomic(using=queryset.db):
+            user_ids = set(unarchived.values_list('user_id', flat=True))
+            updated = unarchived.update(archived_at=now, updated_at=now)
+            self.announce_changes(user_ids, queryset.db)
+        self.message_user(request, f"{updated} task(s) archived.", messages.SUCCESS)
+
+
+@admin.register(Category)
+class CategoryAdmin(PrefixSearchMixin, ShardedModelAdmin):
+    list_display = ['name', 'user', 'color']
+    # Not empty by default: the owner would be joined, but lives on the global database
+    list_select_related = []
+    # Name prefixes, served by the (name, user) unique index; also used by
+    # the category autocomplete on TaskAdmin
+    search_fields = ['name']
+    autocomplete_fields = ['user']
+    ordering = ['-id']
+
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # Category.__str__ shows the owner, including in autocomplete results
+        return super().get_queryset(request).prefetch_related('user')
@@ -0,0 +1,145 @@
+"""
+Async-native read endpoints for tasks and categories.
+
+    GET /api/tasks/async/tasks/
+    GET /api/tasks/async/tasks/overdue/
+    GET /api/tasks/async/tasks/completed/
+    GET /api/tasks/async/tasks/pending/
+    GET /api/tasks/async/categories/
+
+They return the same data as the matching TaskViewSet and CategoryViewSet
+routes and accept the same query parameters (?fields=, ?expand=,
+?subtasks=, ?search=, ?ordering=), but are rendered as JSON only.
+
+Under ASGI the views run on the event loop: the user comes from
+request.auser(), querysets are evaluated with the async ORM interface,
+and only the queries themselves run in a thread. Querysets and
+serializers are still built by the viewsets, so both versions stay in
+step; the user's shard is looked up beforehand with ashard_for_user() and
+handed to the viewset, so building them does no I/O.
+"""
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .serializers import CategorySerializer
+from .sharding import ashard_for_user
+from .views import CategoryViewSet, TaskViewSet
+
+
+def _authenticate(request):
+    """Authenticate the request with the configured DRF authentication classes."""
+    drf_request = Request(
+        request,
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    )
+    return drf_request.user
+
+
+async def aauthenticate(request):
+    """
+    Return the user making the request, or None.
+
+    Session users are loaded with request.auser(); other credentials (an
+    Authorization header) go through the DRF authentication classes and
+    raise AuthenticationFailed when invalid.
+    """
+    user = await request.auser()
+    if not user.is_authenticated and 'HTTP_AUTHORIZATION' in request.META:
+        user = await sync_to_async(_authenticate)(request)
+    if user is None or not user.is_authenticated:
+        return None
+    return user
+
+
+def _json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def _error_response(request, exc):
+    """Render a DRF exception the way the sync views do."""
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = _json_response(data, status=exc.status_code)
+
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        # As in APIView: 401 with a challenge if the first authentication
+        # class provides one, 403 otherwise
+        authenticators = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+        header = authenticators[0]().authenticate_header(Request(request)) if authenticators else None
+        if header:
+            response['WWW-Authenticate'] = header
+        else:
+            response.status_code = 403
+    return response
+
+
+async def _get_view(viewset_class, request, action):
+    """
+    Return an authenticated viewset instance to build querysets with,
+    or raise NotAuthenticated (IsAuthenticated in the sync views).
+    """
+    user = await aauthenticate(request)
+    if user is None:
+        raise exceptions.NotAuthenticated()
+
+    # for_user() would look the shard up synchronously on the event loop
+    shard = await ashard_for_user(user.pk)
+
+    drf_request = Request(request)
+    drf_request.user = user
+    return viewset_class(
+        request=drf_request, action=action, args=(), kwargs={}, format_kwarg=None, shard=shard
+    )
+
+
+async def _render_tasks(view, queryset):
+    """Evaluate the tasks (and ?subtasks=) with the async ORM and serialize them."""
+    tasks = [task async for task in queryset]
+
+    levels = view.get_subtask_levels()
+    if levels:
+        subtasks = [subtask async for subtask in view.get_subtasks_queryset(tasks, levels)]
+        context = view.get_subtask_context(subtasks, levels)
+    else:
+        context = view.get_serializer_context()
+
+    return view.get_serializer_class()(tasks, many=True, context=context).data
+
+
+@require_GET
+async def task_list(request):
+    """Async version of GET /api/tasks/tasks/."""
+    try:
+        view = await _get_view(TaskViewSet, request, 'list')
+        data = await _render_tasks(view, view.filter_queryset(view.get_queryset()))
+    except exceptions.APIException as exc:
+        return _error_response(request, exc)
+    return _json_response(data)
+
+
+@require_GET
+async def task_status_list(request, name):
+    """Async version of GET /api/tasks/tasks/{overdue,completed,pending}/."""
+    try:
+        view = await _get_view(TaskViewSet, request, name)
+        data = await _render_tasks(view, view.get_status_queryset(name))
+    except exceptions.APIException as exc:
+        return _error_response(request, exc)
+    return _json_response(data)
+
+
+@require_GET
+async def category_list(request):
+    """Async version of GET /api/tasks/categories/."""
+    try:
+        view = await _get_view(CategoryViewSet, request, 'list')
+    except exceptions.APIException as exc:
+        return _error_response(request, exc)
+
+    categories = [category async for category in view.get_queryset()]
+    return _json_response(CategorySerializer(categories, many=True).data)
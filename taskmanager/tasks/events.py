@@ -0,0 +1,296 @@
+"""
+Change events for the live task feed.
+
+Task and Category changes are published as events and fanned out to
+per-user subscribers (the SSE stream in tasks/streams.py) through an
+in-process broker. Transport is delegated to a backend, configured with
+settings.TASK_EVENTS_BACKEND:
+- LocalBackend (default) delivers events within the current process
+- Any class with the same interface (a boot attribute, start() and
+  publish()) can be plugged in to carry events between processes
+
+Changes made inside suppress_events() publish nothing; code rewriting a
+user's rows wholesale (rebalance_user) publishes a single reset event
+instead, telling clients to refetch.
+
+Events published while the user has no connected client (as far as the
+broker can tell) carry no data; they are kept for replay only, and
+clients that resume past them refetch the object.
+"""
+
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+
+class Event:
+    """A single change to a Task or Category owned by a user, or a reset of all of them."""
+
+    __slots__ = ('id', 'user_id', 'model', 'action', 'object_id', 'data')
+
+    def __init__(self, user_id, model, action, object_id, data=None, id=None):
+        self.id = id
+        self.user_id = user_id
+        self.model = model  # 'task', 'category', or None for a reset
+        self.action = action  # 'created', 'updated', 'deleted' or 'reset'
+        self.object_id = object_id
+        self.data = data
+
+    @property
+    def sequence(self):
+        """Position of the event in its backend's stream."""
+        return parse_event_id(self.id)[1]
+
+    @property
+    def name(self):
+        """SSE event name, e.g. 'task.updated' or 'reset'."""
+        if self.model is None:
+            return self.action
+        return f'{self.model}.{self.action}'
+
+    def to_sse(self):
+        """Encode the event in text/event-stream format."""
+        payload = json.dumps(
+            {'id': self.object_id, 'model': self.model, 'action': self.action, 'data': self.data},
+            cls=DjangoJSONEncoder,
+        )
+        return f'id: {self.id}\nevent: {self.name}\ndata: {payload}\n\n'
+
+
+class LocalBackend:
+    """
+    Deliver events to the broker of the current process.
+
+    Being local, the broker knows every subscriber an event can reach.
+    Event ids are '<boot>-<sequence>', where boot identifies this process
+    so that ids from a previous process are never mistaken for ours.
+    """
+
+    local = True
+
+    def __init__(self):
+        self.boot = format(time.time_ns(), 'x')
+        self._sequence = itertools.count(1)
+        self._deliver = None
+
+    def start(self, deliver):
+        """Register the callback that receives every published event."""
+        self._deliver = deliver
+
+    def publish(self, event):
+        event.id = f'{self.boot}-{next(self._sequence)}'
+        self._deliver(event)
+
+
+def parse_event_id(event_id):
+    """Split an event id into (boot, sequence), or return None if malformed."""
+    boot, _, sequence = (event_id or '').partition('-')
+    if not boot or not sequence.isdigit():
+        return None
+    return boot, int(sequence)
+
+
+class Subscription:
+    """
+    A bounded queue of events for one connected client.
+
+    When the client falls behind and the queue fills up, the subscription
+    is marked as overflowed instead of buffering without limit; the stream
+    then closes and the client resumes from its last event id.
+    """
+
+    def __init__(self, broker, user_id, loop, max_size):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.overflowed = False
+
+    def deliver(self, event):
+        """Queue an event. Must run on the subscriber's event loop."""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            # Drop the backlog and wake the consumer with a sentinel
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self, timeout):
+        """Wait for the next event; returns None on overflow, raises TimeoutError on timeout."""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    """
+    Fan out events to the subscriptions of their user.
+
+    A per-user ring buffer of recent events allows clients to resume
+    after a reconnect (SSE Last-Event-ID). Buffers are kept for at most
+    max_users users, dropping the least recently active one first.
+    publish() may be called from any thread; delivery happens on each
+    subscriber's event loop.
+    """
+
+    def __init__(self, backend, buffer_size=1000, queue_size=100, max_users=10000):
+        self.backend = backend
+        self.buffer_size = buffer_size
+        self.queue_size = queue_size
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+        # User id -> recent events, least recently active user first
+        self._history = OrderedDict()
+        # Per user buffer, the sequence up to which events may be missing
+        # (evicted from it, or dropped with an earlier buffer)
+        self._evicted = {}
+        # Sequence of the newest event in any buffer dropped as a whole
+        self._dropped = 0
+        backend.start(self._dispatch)
+
+    def has_subscribers(self, user_id):
+        """
+        Return whether an event for the user may reach a connected client.
+
+        Only known for backends delivering in-process; others may have
+        subscribers in another process, so this is always True for them.
+        """
+        if not getattr(self.backend, 'local', False):
+            return True
+        with self._lock:
+            return bool(self._subscriptions.get(user_id))
+
+    def publish(self, event):
+        self.backend.publish(event)
+
+    def subscribe(self, user_id, last_event_id=None):
+        """
+        Register a subscription for a user's events.
+
+        Returns (subscription, missed) where missed is the list of buffered
+        events after last_event_id, or None if they can no longer be
+        replayed and the client has to refetch its state.
+        """
+        subscription = Subscription(self, user_id, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+            missed = self._replay(user_id, last_event_id) if last_event_id else []
+        return subscription, missed
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def _replay(self, user_id, last_event_id):
+        """Return buffered events newer than last_event_id, or None if out of range."""
+        parsed = parse_event_id(last_event_id)
+        if parsed is None or parsed[0] != self.backend.boot:
+            return None
+
+        sequence = parsed[1]
+        history = self._history.get(user_id)
+        # Events after the client's last one have already been evicted,
+        # or the user's buffer may have been dropped as a whole
+        evicted = self._dropped if history is None else self._evicted.get(user_id, 0)
+        if sequence < evicted:
+            return None
+        return [event for event in history or () if event.sequence > sequence]
+
+    def _dispatch(self, event):
+        """Record an event and hand it to the subscribers of its user."""
+        with self._lock:
+            history = self._history.get(event.user_id)
+            if history is None:
+                history = self._history[event.user_id] = deque(maxlen=self.buffer_size)
+                if self._dropped:
+                    self._evicted[event.user_id] = self._dropped
+                if len(self._history) > self.max_users:
+                    self._drop_oldest_history()
+            else:
+                self._history.move_to_end(event.user_id)
+            if len(history) == history.maxlen:
+                self._evicted[event.user_id] = history[0].sequence
+            history.append(event)
+            subscriptions = list(self._subscriptions.get(event.user_id, ()))
+
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The subscriber's event loop has been closed
+                self.unsubscribe(subscription)
+
+    def _drop_oldest_history(self):
+        """Forget the buffer of the least recently active user."""
+        user_id, history = self._history.popitem(last=False)
+        self._evicted.pop(user_id, None)
+        if history:
+            self._dropped = max(self._dropped, history[-1].sequence)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Return the process-wide broker, creating it from settings on first use."""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                backend_class = import_string(
+                    getattr(settings, 'TASK_EVENTS_BACKEND', 'tasks.events.LocalBackend')
+                )
+                _broker = Broker(
+                    backend_class(),
+                    buffer_size=getattr(settings, 'TASK_EVENTS_BUFFER_SIZE', 1000),
+                    queue_size=getattr(settings, 'TASK_EVENTS_QUEUE_SIZE', 100),
+                    max_users=getattr(settings, 'TASK_EVENTS_MAX_USERS', 10000),
+                )
+    return _broker
+
+
+def publish(user_id, model, action, object_id, data=None):
+    """Publish a change event for a user."""
+    get_broker().publish(Event(user_id, model, action, object_id, data))
+
+
+def publish_reset(user_id):
+    """Tell a user's clients that their data changed wholesale and must be refetched."""
+    publish(user_id, None, 'reset', None)
+
+
+_suppressed = threading.local()
+
+
+@contextmanager
+def suppress_events():
+    """Publish no change events for saves and deletes made in this thread inside the block."""
+    previous = events_suppressed()
+    _suppressed.active = True
+    try:
+        yield
+    finally:
+        _suppressed.active = previous
+
+
+def events_suppressed():
+    return getattr(_suppressed, 'active', False)
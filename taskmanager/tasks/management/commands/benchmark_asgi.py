@@ -0,0 +1,250 @@
+import asyncio
+import os
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.asgi import get_asgi_application
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat, LPad
+from django.test import Client
+from django.test.utils import override_settings
+
+from tasks.models import Category, Task
+
+# Sync route and its async version, by --endpoint
+ENDPOINTS = {
+    'tasks': ('/api/tasks/tasks/', '/api/tasks/async/tasks/'),
+    'overdue': ('/api/tasks/tasks/overdue/', '/api/tasks/async/tasks/overdue/'),
+    'pending': ('/api/tasks/tasks/pending/', '/api/tasks/async/tasks/pending/'),
+    'completed': ('/api/tasks/tasks/completed/', '/api/tasks/async/tasks/completed/'),
+    'categories': ('/api/tasks/categories/', '/api/tasks/async/categories/'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the sync read views with their async versions under ASGI. "
+        "Requests are sent in-process to the ASGI application at increasing "
+        "concurrency; throughput, latency, peak threads and peak memory are "
+        "reported. Uses a throwaway database in a temporary directory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='tasks',
+                            help="Route to compare")
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 128],
+                            help="Numbers of requests in flight to compare")
+        parser.add_argument('--requests', type=int, default=400,
+                            help="Requests sent at each concurrency level")
+        parser.add_argument('--tasks', type=int, default=100,
+                            help="Tasks owned by the benchmark user")
+        parser.add_argument('--query-delay', type=float, default=0.0,
+                            help="Milliseconds added to every query, to simulate a remote database")
+        parser.add_argument('--memory-budget', type=float, default=None,
+                            help="Also report the best throughput of each version within this peak memory (MB)")
+
+    def handle(self, *args, **options):
+        sync_path, async_path = ENDPOINTS[options['endpoint']]
+
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(DEBUG=False, ALLOWED_HOSTS=['localhost'], TASK_SHARDS=['default'],
+                                  PROFILING_SAMPLE_RATE=0.0, PROFILING_TOKEN=''):
+            original = self._use_database(os.path.join(directory, 'benchmark.sqlite3'))
+            delay = options['query_delay'] / 1000
+            if delay:
+                add_delay = self._delay_queries(delay)
+                connection_created.connect(add_delay)
+            try:
+                cookie = self._seed(options['tasks'])
+                app = get_asgi_application()
+                results = {
+                    'sync': [self._measure(app, sync_path, cookie, level, options['requests'])
+                             for level in options['concurrency']],
+                    'async': [self._measure(app, async_path, cookie, level, options['requests'])
+                              for level in options['concurrency']],
+                }
+            finally:
+                if delay:
+                    connection_created.disconnect(add_delay)
+                self._restore_database(original)
+
+        self._report(results, options['memory_budget'])
+
+    def _use_database(self, name):
+        """Point the default database at a fresh file and migrate it."""
+        original = connections.settings['default']
+        connections['default'].close()
+        connections.settings['default'] = {
+            **original,
+            'NAME': name,
+            # Wait for the writer lock (sessions) instead of failing under load
+            'OPTIONS': {**original.get('OPTIONS', {}), 'timeout': 60},
+        }
+        del connections['default']
+        call_command('migrate', verbosity=0)
+        return original
+
+    def _restore_database(self, original):
+        connections['default'].close()
+        connections.settings['default'] = original
+        del connections['default']
+
+    def _delay_queries(self, delay):
+        """Return a connection_created receiver slowing down every query."""
+        def sleep_then_execute(execute, sql, params, many, context):
+            time.sleep(delay)
+            return execute(sql, params, many, context)
+
+        def add_delay(sender, connection, **kwargs):
+            if sleep_then_execute not in connection.execute_wrappers:
+                connection.execute_wrappers.append(sleep_then_execute)
+
+        return add_delay
+
+    def _seed(self, task_count):
+        """Create the benchmark user and tasks, returning a session cookie."""
+        user = get_user_model().objects.create_user(username='benchmark', password='benchmark')
+        category = Category.objects.create(name='Benchmark', user=user)
+        Task.objects.bulk_create([
+            Task(
+                title=f'Task {i}',
+                description='Benchmark task ' * 10,
+                status='completed' if i % 3 == 0 else 'pending',
+                category=category if i % 2 else None,
+                user=user,
+            )
+            for i in range(task_count)
+        ])
+        # bulk_create skips save(), so give every task its top-level path
+        Task.objects.update(path=Concat(
+            LPad(Cast('id', CharField()), Task.PATH_SEGMENT_DIGITS, Value('0')), Value('/'),
+            output_field=CharField()
+        ))
+
+        client = Client()
+        client.force_login(user)
+        return '; '.join(f'{name}={morsel.value}' for name, morsel in client.cookies.items())
+
+    def _measure(self, app, path, cookie, concurrency, total):
+        """Serve `total` requests with `concurrency` in flight; return the measurements."""
+        if concurrency > total:
+            raise CommandError("--requests must be at least the highest --concurrency.")
+
+        latencies = []
+        peak_threads = threading.active_count()
+
+        async def worker(remaining):
+            for _ in remaining:
+                started = time.perf_counter()
+                status = await self._get(app, path, cookie)
+                if status != 200:
+                    raise CommandError(f"GET {path} returned {status}.")
+                latencies.append(time.perf_counter() - started)
+
+        async def watch_threads():
+            nonlocal peak_threads
+            while True:
+                peak_threads = max(peak_threads, threading.active_count())
+                await asyncio.sleep(0.001)
+
+        async def run():
+            watcher = asyncio.create_task(watch_threads())
+            # One shared iterator, so each request is sent exactly once
+            remaining = iter(range(total))
+            try:
+                await asyncio.gather(*(worker(remaining) for _ in range(concurrency)))
+            finally:
+                watcher.cancel()
+
+        # Warm up (imports, URL resolver, first connections)
+        asyncio.run(self._get(app, path, cookie))
+
+        tracemalloc.start()
+        try:
+            started = time.perf_counter()
+            asyncio.run(run())
+            elapsed = time.perf_counter() - started
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        latencies.sort()
+        return {
+            'concurrency': concurrency,
+            'throughput': total / elapsed,
+            'p50': statistics.median(latencies),
+            'p95': latencies[int(len(latencies) * 0.95) - 1],
+            'threads': peak_threads,
+            'memory': peak_memory / 2 ** 20,
+        }
+
+    async def _get(self, app, path, cookie):
+        """Send one GET request to the ASGI application and return its status."""
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())],
+            'client': ('127.0.0.1', 0),
+            'server': ('localhost', 80),
+        }
+        body_sent = False
+        never = asyncio.Event()
+        status = None
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # The client stays connected until the response is complete
+            await never.wait()
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+
+        await app(scope, receive, send)
+        return status
+
+    def _report(self, results, memory_budget):
+        self.stdout.write(
+            f"{'version':<7} {'in flight':>9} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'threads':>8} {'peak MB':>8}"
+        )
+        for version, rows in results.items():
+            for row in rows:
+                self.stdout.write(
+                    f"{version:<7} {row['concurrency']:>9} {row['throughput']:>9.1f} "
+                    f"{row['p50'] * 1000:>8.1f} {row['p95'] * 1000:>8.1f} "
+                    f"{row['threads']:>8} {row['memory']:>8.1f}"
+                )
+
+        if memory_budget is None:
+            return
+
+        self.stdout.write(f"\nWithin {memory_budget:g} MB of peak memory:")
+        for version, rows in results.items():
+            fitting = [row for row in rows if row['memory'] <= memory_budget]
+            if not fitting:
+                self.stdout.write(f"  {version}: no concurrency level fits")
+                continue
+            best = max(fitting, key=lambda row: row['throughput'])
+            self.stdout.write(
+                f"  {version}: {best['throughput']:.1f} req/s with {best['concurrency']} in flight"
+            )
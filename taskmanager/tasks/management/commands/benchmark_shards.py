@@ -0,0 +1,139 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings
+
+from tasks.models import Task, UserShard
+from tasks.sharding import GLOBAL_DATABASE
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure concurrent Task write throughput against 1..N SQLite shards. "
+        "Writes go through the sharding layer like the API's: each writer is a "
+        "real user whose tasks are routed to their assigned shard. Writers are "
+        "separate processes with their own connections, so they contend for "
+        "the databases rather than the GIL. Uses throwaway databases in a "
+        "temporary directory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4],
+                            help="Shard counts to compare")
+        parser.add_argument('--writers', type=int, default=8,
+                            help="Concurrent writer processes, one user each")
+        parser.add_argument('--writes', type=int, default=200,
+                            help="Tasks created by each writer")
+
+    def handle(self, *args, **options):
+        baseline = None
+        for shard_count in options['shards']:
+            with tempfile.TemporaryDirectory() as directory:
+                aliases = [f'benchmark_shard_{i}' for i in range(shard_count)]
+                with override_settings(TASK_SHARDS=aliases):
+                    original = self._create_databases(directory, aliases)
+                    try:
+                        users = self._create_users(aliases, options['writers'])
+                        elapsed = self._run(users, options['writes'])
+                        counts = [Task.objects.using(alias).count() for alias in aliases]
+                    finally:
+                        self._drop_databases(aliases, original)
+
+            throughput = options['writers'] * options['writes'] / elapsed
+            baseline = baseline or throughput
+            self.stdout.write(
+                f"{shard_count} shard(s): {throughput:8.1f} writes/s "
+                f"({throughput / baseline:.2f}x), tasks per shard {counts}"
+            )
+
+    def _create_databases(self, directory, aliases):
+        """Point the global database and the shards at fresh files; return the global settings."""
+        original = connections.settings[GLOBAL_DATABASE]
+        connections[GLOBAL_DATABASE].close()
+        del connections[GLOBAL_DATABASE]
+        for alias in [GLOBAL_DATABASE, *aliases]:
+            connections.settings[alias] = {
+                **original,
+                'NAME': os.path.join(directory, f'{alias}.sqlite3'),
+                # Wait for the writer lock instead of failing under contention
+                'OPTIONS': {**original.get('OPTIONS', {}), 'timeout': 60},
+            }
+            call_command('migrate', database=alias, verbosity=0)
+            connections[alias].close()
+        return original
+
+    def _drop_databases(self, aliases, original):
+        for alias in aliases:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        connections[GLOBAL_DATABASE].close()
+        connections.settings[GLOBAL_DATABASE] = original
+        del connections[GLOBAL_DATABASE]
+
+    def _create_users(self, aliases, count):
+        """Create the writers' users, spread evenly over the shards."""
+        User = get_user_model()
+        users = []
+        for i in range(count):
+            user = User.objects.create_user(
+                username=f'writer{i}', email=f'writer{i}@example.com', password='benchmark'
+            )
+            # Assigned round-robin rather than by hash, so small runs stay even
+            UserShard.objects.using(GLOBAL_DATABASE).create(user=user, shard=aliases[i % len(aliases)])
+            users.append(user)
+        connections.close_all()
+        return users
+
+    def _run(self, users, writes):
+        """Run the writers concurrently and return the elapsed seconds."""
+        # Forked writers inherit the benchmark's database settings. No
+        # connection is open at this point (see _create_users), so each
+        # process opens its own.
+        context = multiprocessing.get_context('fork')
+        start = context.Barrier(len(users) + 1)
+        errors = context.SimpleQueue()
+
+        processes = [
+            context.Process(target=_write_tasks, args=(user, writes, start, errors))
+            for user in users
+        ]
+        for process in processes:
+            process.start()
+
+        try:
+            start.wait()
+        except threading.BrokenBarrierError:
+            pass
+        started = time.perf_counter()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+        if not errors.empty():
+            raise CommandError(f"A writer failed: {errors.get()}")
+        if any(process.exitcode for process in processes):
+            raise CommandError("A writer process exited with an error.")
+        return elapsed
+
+
+def _write_tasks(user, writes, start, errors):
+    """Body of a writer process: wait for the others, then create the user's tasks."""
+    try:
+        start.wait()
+        for i in range(writes):
+            # Routed to the user's shard after checking their assignment
+            Task.objects.create(user=user, title=f'Task {i}')
+    except Exception as exc:
+        errors.put(repr(exc))
+        # Release the other writers if this one never reached the barrier
+        start.abort()
+    finally:
+        connections.close_all()
@@ -0,0 +1,87 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from tasks.events import publish_reset, suppress_events
+from tasks.models import Category, Task, UserShard
+from tasks.sharding import GLOBAL_DATABASE, forget_shard, get_shards, shard_for_user
+
+
+class Command(BaseCommand):
+    help = (
+        "Move a user's tasks and categories to another shard. "
+        "Rows get new ids on the target shard, so run it while the user is inactive; "
+        "their live feed clients get a single reset event and refetch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help="User to move")
+        parser.add_argument('shard', help="Target database alias, one of TASK_SHARDS")
+
+    def handle(self, *args, **options):
+        target = options['shard']
+        if target not in get_shards():
+            raise CommandError(f"'{target}' is not listed in TASK_SHARDS.")
+
+        User = get_user_model()
+        try:
+            user = User.objects.using(GLOBAL_DATABASE).get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['username']}' does not exist.")
+
+        source = shard_for_user(user.pk)
+        if source == target:
+            self.stdout.write(f"{user} is already on '{target}'.")
+            return
+
+        # Commit order on exit is source, global, target; a failure before
+        # then rolls back all three. Per-row events would report every row
+        # as deleted, so they are replaced by a reset once done
+        with suppress_events(), \
+                transaction.atomic(using=target), \
+                transaction.atomic(using=GLOBAL_DATABASE), \
+                transaction.atomic(using=source):
+            categories = list(Category.objects.using(source).filter(user_id=user.pk))
+            tasks = list(Task.objects.using(source).filter(user_id=user.pk))
+
+            # Copy categories first so tasks can point at their new ids
+            old_ids = [category.pk for category in categories]
+            for category in categories:
+                category.pk = None
+            Category.objects.using(target).bulk_create(categories)
+            category_ids = dict(zip(old_ids, (category.pk for category in categories)))
+
+            # Parents and paths reference task ids, so they are remapped
+            # once the new ids are known
+            old_task_ids = [task.pk for task in tasks]
+            originals = [(task.created_at, task.updated_at, task.parent_id) for task in tasks]
+            for task in tasks:
+                task.pk = None
+                task.parent_id = None
+                task.category_id = category_ids.get(task.category_id)
+            Task.objects.using(target).bulk_create(tasks)
+            task_ids = dict(zip(old_task_ids, (task.pk for task in tasks)))
+
+            # bulk_create stamps auto_now fields, restore the originals
+            for task, (created_at, updated_at, parent_id) in zip(tasks, originals):
+                task.created_at, task.updated_at = created_at, updated_at
+                task.parent_id = task_ids.get(parent_id)
+                task.path = ''.join(
+                    Task.path_segment(task_ids[int(segment)]) for segment in task.path.split('/')[:-1]
+                )
+            Task.objects.using(target).bulk_update(tasks, ['created_at', 'updated_at', 'parent', 'path'])
+
+            UserShard.objects.using(GLOBAL_DATABASE).update_or_create(
+                user_id=user.pk, defaults={'shard': target}
+            )
+
+            Task.objects.using(source).filter(user_id=user.pk).delete()
+            Category.objects.using(source).filter(user_id=user.pk).delete()
+
+        forget_shard(user.pk)
+        publish_reset(user.pk)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {user} from '{source}' to '{target}': "
+            f"{len(categories)} categories, {len(tasks)} tasks."
+        ))
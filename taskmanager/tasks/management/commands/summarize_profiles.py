@@ -0,0 +1,103 @@
+import io
+import json
+import pstats
+import re
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Collapses "IN (%s, %s, ...)" lists so queries differing only in list length group together
+PLACEHOLDER_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)+\s*\)')
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarize the request profiles captured by ProfilingMiddleware: "
+        "slowest views, hottest functions and hottest queries."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None,
+                            help="Capture directory (default: settings.PROFILING_DIR)")
+        parser.add_argument('--view', default=None,
+                            help="Only include captures whose view contains this text, e.g. TaskViewSet.list")
+        parser.add_argument('--limit', type=int, default=15,
+                            help="Rows shown per section")
+        parser.add_argument('--sort', choices=['cumulative', 'tottime'], default='cumulative',
+                            help="Order of the function profile")
+
+    def handle(self, *args, **options):
+        directory = Path(options['dir'] or getattr(settings, 'PROFILING_DIR', settings.BASE_DIR / 'profiles'))
+        if not directory.is_dir():
+            raise CommandError(f"No captures in '{directory}'.")
+
+        captures = []
+        for path in sorted(directory.glob('*.json')):
+            details = json.loads(path.read_text())
+            if options['view'] and options['view'] not in details['view']:
+                continue
+            captures.append((path, details))
+
+        if not captures:
+            raise CommandError(f"No matching captures in '{directory}'.")
+
+        self.stdout.write(f"{len(captures)} capture(s) from {directory}\n")
+        self._summarize_views(captures, options['limit'])
+        self._summarize_functions(captures, options['limit'], options['sort'])
+        self._summarize_queries(captures, options['limit'])
+
+    def _summarize_views(self, captures, limit):
+        durations = defaultdict(list)
+        for path, details in captures:
+            durations[details['view']].append(details['duration'])
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Views by total time"))
+        self.stdout.write(f"{'requests':>9} {'mean ms':>9} {'max ms':>9}  view")
+        rows = sorted(durations.items(), key=lambda item: sum(item[1]), reverse=True)
+        for view, times in rows[:limit]:
+            self.stdout.write(
+                f"{len(times):>9} {sum(times) / len(times) * 1000:>9.1f} {max(times) * 1000:>9.1f}  {view}"
+            )
+        self.stdout.write('')
+
+    def _summarize_functions(self, captures, limit, sort):
+        profiles = [
+            str(path.with_suffix('.prof')) for path, details in captures
+            if details['profiled'] and path.with_suffix('.prof').exists()
+        ]
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Hottest functions by {sort} time"))
+        if not profiles:
+            self.stdout.write("No function profiles captured.\n")
+            return
+
+        # pstats merges the captures and prints a header we do not need
+        output = io.StringIO()
+        stats = pstats.Stats(*profiles, stream=output)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        table = output.getvalue()
+        start = table.find('   ncalls')
+        self.stdout.write(table[start:] if start != -1 else table)
+
+    def _summarize_queries(self, captures, limit):
+        totals = defaultdict(lambda: {'count': 0, 'time': 0.0})
+        for path, details in captures:
+            for query in details['queries']:
+                key = (query['alias'], PLACEHOLDER_LIST.sub('(%s, ...)', query['sql']))
+                totals[key]['count'] += 1
+                totals[key]['time'] += query['duration']
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Hottest queries by total time"))
+        if not totals:
+            self.stdout.write("No queries captured.")
+            return
+
+        self.stdout.write(f"{'calls':>7} {'total ms':>9} {'mean ms':>9}  database: query")
+        rows = sorted(totals.items(), key=lambda item: item[1]['time'], reverse=True)
+        for (alias, sql), total in rows[:limit]:
+            self.stdout.write(
+                f"{total['count']:>7} {total['time'] * 1000:>9.1f} "
+                f"{total['time'] / total['count'] * 1000:>9.2f}  {alias}: {sql}"
+            )
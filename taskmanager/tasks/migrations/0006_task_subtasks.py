@@ -0,0 +1,61 @@
+# Generated by Django 6.0 on 2026-10-18 23:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat, LPad
+
+
+def set_top_level_paths(apps, schema_editor):
+    """Existing tasks become top-level tasks: path is their own padded id."""
+    Task = apps.get_model('tasks', 'Task')
+    Task.objects.using(schema_editor.connection.alias).update(
+        path=Concat(LPad(Cast('id', CharField()), 10, Value('0')), Value('/'), output_field=CharField())
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0005_task_archived_at_admin_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='completed_descendant_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='descendant_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='subtasks', to='tasks.task'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='path',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'path'], name='task_user_path_idx'),
+        ),
+        migrations.RunPython(
+            set_top_level_paths,
+            migrations.RunPython.noop,
+            # Run on every database holding the sharded tasks table
+            hints={'model_name': 'task'},
+        ),
+    ]
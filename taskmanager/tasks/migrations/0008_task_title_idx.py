@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-19 00:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0007_task_priority_archived_at_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['title'], name='task_title_idx'),
+        ),
+    ]
@@ -1,14 +1,59 @@
-from django.db import models
+from collections import Counter
+
+from django.db import models, router, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Concat, Substr
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.dispatch import Signal
 from django.utils import timezone
 
+from .sharding import shard_for_user
+
+# Sent by Task.move_to() once a subtree has moved, with the moved task as
+# instance and the ids of its former ancestors as previous_ancestor_ids
+task_moved = Signal()
+
 # Create your models here.
+class ShardedQuerySet(models.QuerySet):
+    """QuerySet for models stored on the shard of their owning user."""
+
+    def for_user(self, user, shard=None):
+        """
+        Return the user's rows, read from the user's shard. Pass shard when
+        it is known already, e.g. from ashard_for_user() in async code,
+        which must not look it up synchronously.
+        """
+        return self.using(shard or shard_for_user(user.pk)).filter(user=user)
+
+    def create(self, **kwargs):
+        # Without an explicit database, write to the owner's current shard
+        if self._db is None:
+            user = kwargs.get('user')
+            user_id = kwargs.get('user_id', getattr(user, 'pk', None))
+            if user_id is not None:
+                shard = shard_for_user(user_id, verify=True)
+                return super(ShardedQuerySet, self.using(shard)).create(**kwargs)
+        return super().create(**kwargs)
+
+
+class UserShard(models.Model):
+    """Database shard holding a user's tasks and categories (see tasks.sharding)"""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='task_shard')
+    shard = models.CharField(max_length=100)
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.shard}"
+
+
 class Category(models.Model):
     """Category model for task categorization (stretch goal)"""
     name = models.CharField(max_length=50)
     color = models.CharField(max_length=7, default='#007bff')  # Hex color
-    user = models.ForeignKey( settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='categories')
+    # No database constraint: users live on the global database, categories may be on a shard
+    user = models.ForeignKey( settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='categories', db_constraint=False)
+
+    objects = ShardedQuerySet.as_manager()
     
     class Meta:
         unique_together = ['name', 'user']
@@ -18,6 +63,26 @@ class Category(models.Model):
         return f"{self.name} ({self.user.username})"
      
 class Task(models.Model):
+    """
+    A user's task, optionally nested under a parent task.
+
+    The hierarchy is stored as a materialized path: path holds the
+    zero-padded ids of all ancestors and the task itself, e.g.
+    '0000000003/0000000017/'. A subtree is therefore one index range scan,
+    and moving a subtree is one UPDATE that rewrites the path prefix.
+
+    descendant_count and completed_descendant_count roll up the whole
+    subtree and are kept up to date incrementally on save, move and delete.
+    The tree columns are only written by those incremental UPDATEs; saving
+    an existing task leaves them out, so a stale instance cannot undo them.
+    """
+
+    # Width of one path segment (a zero-padded id plus the separator)
+    PATH_SEGMENT_DIGITS = 10
+    # Deepest allowed nesting level (top-level tasks have depth 0)
+    MAX_DEPTH = 20
+    # Columns maintained by the tree methods rather than by save()
+    TREE_FIELDS = ['parent', 'path', 'depth', 'descendant_count', 'completed_descendant_count']
 
     PRIORITY_CHOICES = [
         ('low', 'Low'),
@@ -35,7 +100,8 @@ class Task(models.Model):
     priority = models.CharField(max_length=10,  choices=PRIORITY_CHOICES, default='medium')
 
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
-    user = models.ForeignKey( settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='tasks')
+    # No database constraint: users live on the global database, tasks may be on a shard
+    user = models.ForeignKey( settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='tasks', db_constraint=False)
     category = models.ForeignKey( 'Category', on_delete=models.SET_NULL, null=True, blank=True, related_name='tasks')
 
     due_date = models.DateField(null=True, blank=True)
@@ -43,6 +109,40 @@ class Task(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     completed_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(null=True, blank=True)
+
+    # Subtask hierarchy
+    # Subtasks are deleted by Task.delete() through the path, not by a cascade
+    parent = models.ForeignKey('self', on_delete=models.DO_NOTHING, null=True, blank=True, related_name='subtasks')
+    path = models.CharField(max_length=255, blank=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    descendant_count = models.PositiveIntegerField(default=0, editable=False)
+    completed_descendant_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Serves per-user due date range scans (agenda/calendar views)
+            models.Index(fields=['user', 'due_date'], name='task_user_due_date_idx'),
+            # Serve the admin changelist filters and date hierarchy across all users
+            models.Index(fields=['status', 'due_date'], name='task_status_due_date_idx'),
+            models.Index(fields=['due_date'], name='task_due_date_idx'),
+            models.Index(fields=['priority'], name='task_priority_idx'),
+            models.Index(fields=['archived_at'], name='task_archived_at_idx'),
+            # Subtree lookups are range scans on the path prefix
+            models.Index(fields=['user', 'path'], name='task_user_path_idx'),
+            # Admin search and parent autocomplete (prefix ranges on title)
+            models.Index(fields=['title'], name='task_title_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored status and parent to detect changes on save
+        instance._loaded_status = instance.__dict__.get('status')
+        instance._loaded_parent_id = instance.__dict__.get('parent_id')
+        return instance
 
     def clean(self):
         """Model-level validation"""
@@ -58,10 +158,214 @@ class Task(models.Model):
         elif self.status == 'pending' and self.completed_at:
             self.completed_at = None
 
+        # Subtasks must belong to the same user and stay within MAX_DEPTH
+        if self._state.adding and self.parent_id is not None:
+            if self.parent.user_id != self.user_id:
+                raise ValidationError("Parent task must belong to the same user.")
+            if self.parent.depth + 1 > self.MAX_DEPTH:
+                raise ValidationError(f"Subtasks cannot be nested more than {self.MAX_DEPTH} levels deep.")
+
     def save(self, *args, **kwargs):
         # Run clean() before saving
         self.clean()
-        super().save(*args, **kwargs)
+
+        adding = self._state.adding
+        previous_status = getattr(self, '_loaded_status', None)
+        previous_parent_id = getattr(self, '_loaded_parent_id', self.parent_id)
+        status_changed = previous_status is not None and previous_status != self.status
+        reparented = not adding and previous_parent_id != self.parent_id
+
+        if not adding:
+            kwargs['update_fields'] = self._saved_fields(kwargs.get('update_fields'))
+
+        if not (adding or status_changed or reparented):
+            super().save(*args, **kwargs)
+            return
+
+        # The row and the rollups of its ancestors are written together,
+        # on the database routed to once
+        using = kwargs['using'] = kwargs.get('using') or router.db_for_write(self.__class__, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            if reparented:
+                # Reparented through a form: move the subtree along
+                new_parent = self.parent
+                self.parent_id = previous_parent_id
+                self.move_to(new_parent)
+
+            super().save(*args, **kwargs)
+
+            if adding:
+                self._insert_into_tree()
+            elif status_changed:
+                change = 1 if self.status == 'completed' else -1
+                self._ancestors().update(
+                    completed_descendant_count=F('completed_descendant_count') + change
+                )
+
+        self._loaded_status = self.status
+        self._loaded_parent_id = self.parent_id
+
+    def _saved_fields(self, update_fields=None):
+        """Return the fields saving an existing task writes: the loaded (or given) ones but TREE_FIELDS."""
+        tree_fields = set(self.TREE_FIELDS) | {self._meta.get_field(name).attname for name in self.TREE_FIELDS}
+        if update_fields is None:
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred
+            ]
+        return [name for name in update_fields if name not in tree_fields]
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=self._state.db, savepoint=False):
+            # Subtract what the row holds, not what this instance last saw
+            status = self._refresh_tree_fields()
+
+            # Remove the whole subtree from the ancestors' rollups
+            self._ancestors().update(
+                descendant_count=F('descendant_count') - (self.descendant_count + 1),
+                completed_descendant_count=(
+                    F('completed_descendant_count')
+                    - (self.completed_descendant_count + int(status == 'completed'))
+                ),
+            )
+
+            # Subtasks go in one range query rather than a cascade per level;
+            # the count was just read under the row lock, so leaves skip it
+            deleted, counts = self.descendants().delete() if self.descendant_count else (0, {})
+            own_deleted, own_counts = super().delete(*args, **kwargs)
+
+        for label, count in own_counts.items():
+            counts[label] = counts.get(label, 0) + count
+        return deleted + own_deleted, counts
+
+    def _refresh_tree_fields(self):
+        """
+        Reload TREE_FIELDS from the row, locking it, and return the stored
+        status. The rollups are adjusted by what is stored: another
+        instance may have added subtasks or moved the task since this one
+        was loaded, and an unsaved status change is not counted yet.
+        """
+        columns = [self._meta.get_field(name).attname for name in self.TREE_FIELDS]
+        row = Task.objects.using(self._state.db).select_for_update().values('status', *columns).get(pk=self.pk)
+        for column in columns:
+            setattr(self, column, row[column])
+        return row['status']
+
+    @classmethod
+    def path_segment(cls, pk):
+        return f'{pk:0{cls.PATH_SEGMENT_DIGITS}d}/'
+
+    @staticmethod
+    def path_range(path):
+        """
+        Lookup for all paths starting with the given prefix.
+
+        Expressed as a range rather than LIKE so it can use the index
+        ('0' is the character right after the '/' separator).
+        """
+        return Q(path__gte=path, path__lt=path[:-1] + '0')
+
+    def ancestor_ids(self):
+        """Ids of all ancestors, root first, read from the path."""
+        return [int(segment) for segment in self.path.split('/')[:-2]]
+
+    def _ancestors(self):
+        return Task.objects.using(self._state.db).filter(pk__in=self.ancestor_ids())
+
+    def _insert_into_tree(self):
+        """Set the path of a newly inserted task and count it in its ancestors."""
+        parent_path = self.parent.path if self.parent_id else ''
+        self.path = parent_path + self.path_segment(self.pk)
+        self.depth = self.path.count('/') - 1
+        Task.objects.using(self._state.db).filter(pk=self.pk).update(path=self.path, depth=self.depth)
+
+        self._ancestors().update(
+            descendant_count=F('descendant_count') + 1,
+            completed_descendant_count=F('completed_descendant_count') + int(self.status == 'completed'),
+        )
+
+    @classmethod
+    def adjust_completed_counts(cls, paths, change, using=None):
+        """
+        Add change to completed_descendant_count of the ancestors of the
+        tasks with the given paths, for bulk status updates that bypass
+        save(). Runs a single UPDATE.
+        """
+        changes = Counter(
+            int(segment) for path in paths for segment in path.split('/')[:-2]
+        )
+        if not changes:
+            return
+        cls.objects.using(using).filter(pk__in=changes).update(
+            completed_descendant_count=F('completed_descendant_count') + Case(
+                *[When(pk=pk, then=Value(count * change)) for pk, count in changes.items()]
+            )
+        )
+
+    def subtree(self):
+        """QuerySet of this task and all its descendants (one range query)."""
+        return Task.objects.using(self._state.db).filter(self.path_range(self.path), user_id=self.user_id)
+
+    def descendants(self):
+        return self.subtree().exclude(pk=self.pk)
+
+    def move_to(self, parent):
+        """
+        Move this task and its subtree under parent (None for top level).
+
+        Runs a constant number of queries whatever the subtree size, and
+        sends task_moved for the live feed.
+        """
+        if parent is not None and parent.user_id != self.user_id:
+            raise ValidationError("Parent task must belong to the same user.")
+
+        with transaction.atomic(using=self._state.db, savepoint=False):
+            status = self._refresh_tree_fields()
+            if parent is not None:
+                # The new path is built from the parent's, so it must be current too
+                parent._refresh_tree_fields()
+            if parent is not None and parent.path.startswith(self.path):
+                raise ValidationError("A task cannot be moved under itself or its subtasks.")
+
+            if (parent.pk if parent else None) == self.parent_id:
+                return
+
+            new_path = (parent.path if parent else '') + self.path_segment(self.pk)
+            depth_change = (new_path.count('/') - 1) - self.depth
+
+            deepest = self.subtree().aggregate(deepest=models.Max('depth'))['deepest']
+            if deepest + depth_change > self.MAX_DEPTH:
+                raise ValidationError(f"Subtasks cannot be nested more than {self.MAX_DEPTH} levels deep.")
+
+            moved = self.descendant_count + 1
+            moved_completed = self.completed_descendant_count + int(status == 'completed')
+            old_path = self.path
+            previous_ancestor_ids = self.ancestor_ids()
+
+            self._ancestors().update(
+                descendant_count=F('descendant_count') - moved,
+                completed_descendant_count=F('completed_descendant_count') - moved_completed,
+            )
+
+            # Rewrite the path prefix of the whole subtree in one statement
+            self.subtree().update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1), output_field=models.CharField()),
+                depth=F('depth') + depth_change,
+            )
+            Task.objects.using(self._state.db).filter(pk=self.pk).update(parent=parent)
+
+            self.parent = parent
+            self._loaded_parent_id = self.parent_id
+            self.path = new_path
+            self.depth += depth_change
+
+            self._ancestors().update(
+                descendant_count=F('descendant_count') + moved,
+                completed_descendant_count=F('completed_descendant_count') + moved_completed,
+            )
+
+            task_moved.send(sender=Task, instance=self, previous_ancestor_ids=previous_ancestor_ids)
 
     @property #Property decorator to check if task is overdue
     def is_overdue(self):
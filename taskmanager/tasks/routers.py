@@ -0,0 +1,79 @@
+import logging
+
+from django.conf import settings
+
+from .sharding import GLOBAL_DATABASE, get_shards, pinned_shard, shard_for_user
+
+logger = logging.getLogger(__name__)
+
+
+class TaskShardRouter:
+    """
+    Database router that shards Task and Category by user.
+
+    Queries are routed by the instance hint Django passes for saves and
+    related lookups (a task, category or user). Querysets without a hint
+    should be pinned with Task.objects.for_user(user), which is what the
+    viewsets do, or run inside sharding.pin_shard(); when sharded, others
+    are logged as a warning, since they can only read the global database.
+    New rows are routed after checking the owner's assignment row rather
+    than the cache. All other models are kept on the global database.
+    """
+
+    sharded_models = {'task', 'category'}
+
+    def is_sharded(self, model):
+        return model._meta.app_label == 'tasks' and model._meta.model_name in self.sharded_models
+
+    def _db_for_instance(self, model, instance, write=False):
+        """Return the shard implied by an instance hint."""
+        if instance is not None:
+            if self.is_sharded(type(instance)):
+                if instance._state.db:
+                    return instance._state.db
+                if instance.user_id is not None:
+                    return shard_for_user(instance.user_id, verify=write)
+
+            # Reverse lookups from a user, e.g. user.tasks.all()
+            elif instance._meta.label == settings.AUTH_USER_MODEL and instance.pk is not None:
+                return shard_for_user(instance.pk, verify=write)
+
+        pinned = pinned_shard()
+        if pinned is not None:
+            return pinned
+        if len(get_shards()) > 1:
+            logger.warning(
+                "%s query without a shard hint falls back to '%s'; pin it with "
+                "%s.objects.for_user(user) or .using(shard).",
+                model._meta.label, GLOBAL_DATABASE, model.__name__, stack_info=True,
+            )
+        return None
+
+    def db_for_read(self, model, **hints):
+        if self.is_sharded(model):
+            return self._db_for_instance(model, hints.get('instance'))
+        return GLOBAL_DATABASE
+
+    def db_for_write(self, model, **hints):
+        if self.is_sharded(model):
+            return self._db_for_instance(model, hints.get('instance'), write=True)
+        return GLOBAL_DATABASE
+
+    def allow_relation(self, obj1, obj2, **hints):
+        sharded1, sharded2 = self.is_sharded(type(obj1)), self.is_sharded(type(obj2))
+
+        # Sharded rows only relate to rows on the same shard
+        if sharded1 and sharded2:
+            return obj1._state.db == obj2._state.db
+
+        # Sharded rows reference users on the global database
+        if sharded1 or sharded2:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == 'tasks' and model_name in self.sharded_models:
+            # Also kept on the global database so user deletion can
+            # cascade there even when it is not a shard
+            return db == GLOBAL_DATABASE or db in get_shards()
+        return db == GLOBAL_DATABASE
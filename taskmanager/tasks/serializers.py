@@ -1,9 +1,18 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from .models import Task, Category
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
 
+def parse_list_param(request, name):
+    """Return the comma-separated values of a query parameter as a set."""
+    if request is None:
+        return set()
+    value = request.query_params.get(name, '')
+    return {item.strip() for item in value.split(',') if item.strip()}
+
+
 class CategorySerializer(serializers.ModelSerializer):
     """Serializer for Category model"""
     class Meta:
@@ -17,6 +26,19 @@ class CategorySerializer(serializers.ModelSerializer):
         return super().create(validated_data) # Call the parent create method
 
 class TaskSerializer(serializers.ModelSerializer):
+    """
+    Serializer for Task model.
+
+    Supports sparse fieldsets and optional expansion through the request:
+    - ?fields=id,title,status limits the output to the listed fields (on
+      writes every field is still accepted; only the response is trimmed)
+    - ?expand=category renders the nested category object instead of its id
+    - ?subtasks=N nests subtasks N levels deep (the view loads them into
+      context['subtasks'], a mapping of task id to its child tasks)
+    """
+
+    # Fields that can be expanded into nested objects via ?expand=
+    expandable_fields = ['category']
 
     # Read-only nested category
     category = CategorySerializer(read_only=True)
@@ -29,32 +51,143 @@ class TaskSerializer(serializers.ModelSerializer):
         allow_null=True
     )
 
+    # Read-only parent id
+    parent = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    # Write-only parent id, limited to the user's own tasks
+    parent_id = serializers.PrimaryKeyRelatedField(source='parent',
+        queryset=Task.objects.none(),  # will be set dynamically
+        write_only=True,
+        required=False,
+        allow_null=True
+    )
+
+    # Completion rollup over the whole subtree
+    subtasks_total = serializers.IntegerField(source='descendant_count', read_only=True)
+    subtasks_completed = serializers.IntegerField(source='completed_descendant_count', read_only=True)
+
     class Meta:
         model = Task
         fields = [
             'id', 'title', 'description', 'priority', 'status', 'due_date',
-            'created_at', 'updated_at', 'completed_at',
-            'category', 'category_id'
+            'created_at', 'updated_at', 'completed_at', 'archived_at',
+            'category', 'category_id', 'parent', 'parent_id', 'depth',
+            'subtasks_total', 'subtasks_completed'
         ]
         read_only_fields = [
             'id', 'created_at', 'updated_at',
-            'completed_at', 'user', 'category'
+            'completed_at', 'archived_at', 'user', 'category', 'depth'
         ]
 
     def __init__(self, *args, **kwargs):
-        """Limit categories to the logged-in user"""
+        """Limit categories and parents to the logged-in user"""
         super().__init__(*args, **kwargs)
 
         request = self.context.get('request') # Get the request from context
         if request and request.user.is_authenticated: # Check if user is authenticated
-            self.fields['category_id'].queryset = Category.objects.filter(
-                user=request.user
-            )
+            shard = self.context.get('shard')  # Known already in the async views
+            self.fields['category_id'].queryset = Category.objects.for_user(request.user, shard=shard)
+            self.fields['parent_id'].queryset = Task.objects.for_user(request.user, shard=shard)
+
+        if request is not None:
+            self._apply_sparse_fields(request)
+
+        # Nested subtasks, only when the view has loaded them
+        if 'subtasks' in self.context:
+            self.fields['subtasks'] = serializers.SerializerMethodField()
+
+    def _apply_sparse_fields(self, request):
+        """Restrict readable fields to ?fields= and collapse unexpanded relations."""
+        requested = parse_list_param(request, 'fields')
+        if requested and request.method not in SAFE_METHODS:
+            # Writable fields are input too, so trim the output instead
+            self._output_fields = requested
+        elif requested:
+            for name in list(self.fields):
+                # Write-only fields are input, not output, so keep them
+                if name not in requested and not self.fields[name].write_only:
+                    self.fields.pop(name)
+
+        # Unexpanded relations are rendered as their primary key,
+        # which reads the local FK column and needs no join
+        expand = parse_list_param(request, 'expand')
+        for name in self.expandable_fields:
+            if name in self.fields and name not in expand:
+                self.fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        output_fields = getattr(self, '_output_fields', None)
+        if output_fields:
+            data = {name: value for name, value in data.items() if name in output_fields}
+        return data
+
+    def get_subtasks(self, obj):
+        """
+        Render the loaded children of a task, one level less deep each time.
+
+        Returns None below the requested depth, where children were not loaded.
+        """
+        levels = self.context.get('subtask_levels', 0)
+        if levels <= 0:
+            return None
+        children = self.context['subtasks'].get(obj.pk, [])
+        context = {**self.context, 'subtask_levels': levels - 1}
+        return TaskSerializer(children, many=True, context=context).data
+
+    @classmethod
+    def get_query_options(cls, request):
+        """
+        Return (columns, related) needed to render the requested output.
+
+        columns is the list of model fields to load (None means all fields)
+        and related is the list of relations to join.
+        """
+        requested = parse_list_param(request, 'fields')
+        expand = parse_list_param(request, 'expand')
+
+        readable = [
+            name for name in cls.Meta.fields
+            if name not in ('category_id', 'parent_id') and (not requested or name in requested)
+        ]
+        related = [name for name in cls.expandable_fields if name in readable and name in expand]
+
+        if not requested:
+            return None, related
+
+        # Always load the primary key so instances stay addressable,
+        # and the tree columns when subtasks are nested
+        columns = {'id'}
+        for name in readable:
+            # Declared fields may read a differently named model field
+            declared = cls._declared_fields.get(name)
+            columns.add(getattr(declared, 'source', None) or name)
+        if request.query_params.get('subtasks'):
+            columns.update(['parent', 'path', 'depth'])
+        columns.update(f'{name}__{field}' for name in related for field in CategorySerializer.Meta.fields)
+        return sorted(columns), related
 
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
+    def update(self, instance, validated_data):
+        """Reparent through Task.move_to() so the subtree moves along."""
+        if 'parent' in validated_data:
+            try:
+                instance.move_to(validated_data.pop('parent'))
+            except ValidationError as exc:
+                raise serializers.ValidationError({'parent_id': exc.messages})
+        return super().update(instance, validated_data)
+
+    def validate_parent_id(self, value):
+        """Keep new subtasks within the nesting limit"""
+        if value and self.instance is None and value.depth + 1 > Task.MAX_DEPTH:
+            raise serializers.ValidationError(
+                f"Subtasks cannot be nested more than {Task.MAX_DEPTH} levels deep."
+            )
+        return value
+
     def validate_due_date(self, value):
         """Ensure due date is in the future (DateField-safe)"""
         if value and value < timezone.now().date():
@@ -75,6 +208,17 @@ class TaskSerializer(serializers.ModelSerializer):
                 )
         return value
 
+class TaskEventSerializer(TaskSerializer):
+    """
+    Task payload of live feed events.
+
+    Renders the category as its id, read from the local FK column, so
+    building an event never queries the database.
+    """
+
+    category = serializers.PrimaryKeyRelatedField(read_only=True)
+
+
 class TaskUpdateSerializer(serializers.ModelSerializer):
     """Serializer for updating Task status only"""
 
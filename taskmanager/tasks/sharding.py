@@ -0,0 +1,136 @@
+"""
+User-based sharding of the tasks app tables.
+
+Task and Category rows live on one of the databases listed in
+settings.TASK_SHARDS, chosen per user. Everything else (users, tokens,
+sessions, the shard assignments themselves) stays on GLOBAL_DATABASE.
+
+A user is assigned to a shard on first use and the assignment is stored
+in UserShard, so adding shards later does not move existing users. Use
+the rebalance_user management command to move a user explicitly.
+
+Assignments are cached in settings.TASK_SHARD_CACHE. With several worker
+processes it must be a cache they share (e.g. Redis or Memcached), so
+that moving a user invalidates the assignment everywhere. New rows are
+written after checking the assignment row itself, so a stale cache entry
+can delay reads from the new shard but never strands writes on the old one.
+"""
+
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+
+# Database for all non-sharded models
+GLOBAL_DATABASE = 'default'
+
+# Seconds a user's shard assignment is cached
+ASSIGNMENT_CACHE_TIMEOUT = 300
+
+# Shard for sharded queries that carry no hint, see pin_shard()
+_pinned_shard = ContextVar('pinned_shard', default=None)
+
+
+def get_shards():
+    """Return the database aliases that hold the sharded tables."""
+    return list(getattr(settings, 'TASK_SHARDS', [GLOBAL_DATABASE]))
+
+
+def get_cache():
+    """Return the cache holding shard assignments."""
+    return caches[getattr(settings, 'TASK_SHARD_CACHE', DEFAULT_CACHE_ALIAS)]
+
+
+def _cache_key(user_id):
+    return f'tasks:shard:{user_id}'
+
+
+def default_shard(user_id, shards=None):
+    """Return the shard a new user is assigned to."""
+    shards = shards or get_shards()
+    return shards[zlib.crc32(str(user_id).encode()) % len(shards)]
+
+
+def _lookup_shard(user_id, verify):
+    """
+    Shard lookup shared by shard_for_user() and ashard_for_user().
+
+    A generator yielding the cache and database calls to make, as
+    (object, method name, keyword arguments). The sync version calls the
+    method and the async one awaits its a-prefixed twin (cache.aget(),
+    aget_or_create(), ...); either sends the result back. Returns the shard.
+    """
+    shards = get_shards()
+    if len(shards) == 1:
+        # Unsharded setup, no assignment needed
+        return shards[0]
+
+    cache = get_cache()
+    key = _cache_key(user_id)
+    shard = None if verify else (yield cache, 'get', {'key': key})
+    if shard is None:
+        assignments = apps.get_model('tasks', 'UserShard').objects.using(GLOBAL_DATABASE)
+        assignment, created = yield assignments, 'get_or_create', {
+            'user_id': user_id,
+            'defaults': {'shard': default_shard(user_id, shards)},
+        }
+        shard = assignment.shard
+        yield cache, 'set', {'key': key, 'value': shard, 'timeout': ASSIGNMENT_CACHE_TIMEOUT}
+    return shard
+
+
+def shard_for_user(user_id, verify=False):
+    """
+    Return the database alias holding the given user's tasks and categories.
+
+    With verify=True the assignment row is read even if it is cached, as
+    done before inserting rows.
+    """
+    lookup = _lookup_shard(user_id, verify)
+    result = None
+    while True:
+        try:
+            target, method, kwargs = lookup.send(result)
+        except StopIteration as done:
+            return done.value
+        result = getattr(target, method)(**kwargs)
+
+
+async def ashard_for_user(user_id, verify=False):
+    """Async version of shard_for_user(), for async views."""
+    lookup = _lookup_shard(user_id, verify)
+    result = None
+    while True:
+        try:
+            target, method, kwargs = lookup.send(result)
+        except StopIteration as done:
+            return done.value
+        result = await getattr(target, f'a{method}')(**kwargs)
+
+
+def forget_shard(user_id):
+    """Drop the cached assignment of a user, e.g. after moving them."""
+    get_cache().delete(_cache_key(user_id))
+
+
+@contextmanager
+def pin_shard(alias):
+    """
+    Route sharded queries without a hint to the given shard inside the block.
+
+    For code that cannot pass .using() down, such as Django's own unique
+    checks and deletion collectors run by the admin.
+    """
+    token = _pinned_shard.set(alias)
+    try:
+        yield
+    finally:
+        _pinned_shard.reset(token)
+
+
+def pinned_shard():
+    """Return the shard set by an enclosing pin_shard() block, if any."""
+    return _pinned_shard.get()
@@ -0,0 +1,94 @@
+"""
+Signal receivers that publish Task and Category changes to the live feed.
+
+Receivers cover saves and deletes made through the viewsets as well as
+direct Task.save() calls. A move (Task.move_to()) updates rows through
+querysets, so it is announced separately: an `updated` event for every
+task it changed, or a reset past settings.TASK_EVENTS_MOVE_LIMIT. Events are published once the surrounding
+transaction commits, so subscribers never see rolled-back changes, and
+their payload is only rendered then, from the committed state, if the
+user has a client listening.
+
+Also removes a deleted user's rows from their shard, which the database
+cascade on the global database cannot reach.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.db.models import Q
+from django.dispatch import receiver
+
+from . import events
+from .models import Category, Task, task_moved
+from .serializers import CategorySerializer, TaskEventSerializer
+from .sharding import GLOBAL_DATABASE, shard_for_user
+
+
+def _publish_on_commit(instance, model, action, serializer_class=None):
+    if events.events_suppressed():
+        return
+
+    # Capture the ids now: a deleted instance has no pk by commit time
+    user_id, object_id = instance.user_id, instance.pk
+
+    def publish():
+        data = None
+        if serializer_class is not None and events.get_broker().has_subscribers(user_id):
+            data = serializer_class(instance).data
+        events.publish(user_id, model, action, object_id, data)
+
+    transaction.on_commit(publish, using=instance._state.db)
+
+
+@receiver(post_save, sender=Task, dispatch_uid='tasks.publish_task_saved')
+def publish_task_saved(sender, instance, created, **kwargs):
+    # post_save runs before Task.save() gives a new subtask its path and
+    # depth; the payload is rendered on commit, once they are set
+    _publish_on_commit(instance, 'task', 'created' if created else 'updated', TaskEventSerializer)
+
+
+@receiver(post_delete, sender=Task, dispatch_uid='tasks.publish_task_deleted')
+def publish_task_deleted(sender, instance, **kwargs):
+    _publish_on_commit(instance, 'task', 'deleted')
+
+
+@receiver(task_moved, sender=Task, dispatch_uid='tasks.publish_task_moved')
+def publish_task_moved(sender, instance, previous_ancestor_ids, **kwargs):
+    if events.events_suppressed():
+        return
+
+    # The moved subtree changed depth and the old and new ancestors their rollups
+    user_id, path, using = instance.user_id, instance.path, instance._state.db
+    ancestor_ids = set(previous_ancestor_ids) | set(instance.ancestor_ids())
+    changed = instance.descendant_count + 1 + len(ancestor_ids)
+
+    def publish():
+        if changed > getattr(settings, 'TASK_EVENTS_MOVE_LIMIT', 100):
+            events.publish_reset(user_id)
+            return
+        tasks = Task.objects.using(using).filter(Q(pk__in=ancestor_ids) | Task.path_range(path), user_id=user_id)
+        render = events.get_broker().has_subscribers(user_id)
+        for task in tasks.order_by('path'):
+            data = TaskEventSerializer(task).data if render else None
+            events.publish(user_id, 'task', 'updated', task.pk, data)
+
+    transaction.on_commit(publish, using=using)
+
+
+@receiver(post_save, sender=Category, dispatch_uid='tasks.publish_category_saved')
+def publish_category_saved(sender, instance, created, **kwargs):
+    _publish_on_commit(instance, 'category', 'created' if created else 'updated', CategorySerializer)
+
+
+@receiver(post_delete, sender=Category, dispatch_uid='tasks.publish_category_deleted')
+def publish_category_deleted(sender, instance, **kwargs):
+    _publish_on_commit(instance, 'category', 'deleted')
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL, dispatch_uid='tasks.delete_sharded_rows')
+def delete_sharded_rows(sender, instance, **kwargs):
+    shard = shard_for_user(instance.pk)
+    if shard != GLOBAL_DATABASE:
+        Task.objects.using(shard).filter(user_id=instance.pk).delete()
+        Category.objects.using(shard).filter(user_id=instance.pk).delete()
@@ -0,0 +1,103 @@
+"""
+Live change feed for tasks and categories, served as Server-Sent Events.
+
+Clients keep one connection open instead of polling the task endpoints:
+
+    GET /api/tasks/stream/
+
+Each event carries an id; on reconnect the browser (or client) sends it
+back as the Last-Event-ID header (or ?last_event_id=) and receives the
+events it missed. When they can no longer be replayed, or the user's data
+was replaced wholesale (e.g. moved to another shard), a "reset" event is
+sent and the client should refetch its data.
+
+The view is async and only served by the ASGI application, where an idle
+connection costs no worker thread. Under WSGI (including runserver) the
+endless stream would be collected in a worker before anything is sent,
+so it answers 501 there instead.
+"""
+
+import asyncio
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import AuthenticationFailed
+
+from .async_views import aauthenticate
+from .events import get_broker, parse_event_id
+
+# Reconnection delay suggested to clients, in milliseconds
+RETRY_MS = 3000
+
+
+async def _event_stream(user_id, last_event_id, heartbeat):
+    """Yield the SSE stream for a user until the client disconnects or falls behind."""
+    subscription, missed = get_broker().subscribe(user_id, last_event_id)
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+
+        last_sequence = None
+        if missed is None:
+            # Too far behind (or unknown id): the client must refetch
+            yield 'event: reset\ndata: {}\n\n'
+        else:
+            parsed = parse_event_id(last_event_id)
+            last_sequence = parsed[1] if parsed else None
+            for event in missed:
+                last_sequence = event.sequence
+                yield event.to_sse()
+
+        while True:
+            try:
+                event = await subscription.get(timeout=heartbeat)
+            except asyncio.TimeoutError:
+                # Comment line keeps proxies from closing an idle connection
+                yield ': heartbeat\n\n'
+                continue
+
+            if event is None:
+                # The client could not keep up; it reconnects with its
+                # last event id and catches up from the replay buffer
+                yield 'event: overflow\ndata: {}\n\n'
+                return
+
+            # Skip events already sent during the replay
+            if last_sequence is not None and event.sequence <= last_sequence:
+                continue
+            yield event.to_sse()
+    finally:
+        subscription.close()
+
+
+@require_GET
+async def task_event_stream(request):
+    """Stream the authenticated user's Task and Category changes."""
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {"detail": "The live feed is only available when served over ASGI."},
+            status=501
+        )
+
+    try:
+        user = await aauthenticate(request)
+    except AuthenticationFailed:
+        user = None
+    if user is None:
+        return JsonResponse(
+            {"detail": "Authentication credentials were not provided."},
+            status=401
+        )
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    heartbeat = getattr(settings, 'TASK_EVENTS_HEARTBEAT', 15)
+
+    response = StreamingHttpResponse(
+        _event_stream(user.pk, last_event_id, heartbeat),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Ask nginx-style proxies not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,3 +1,741 @@
-from django.test import TestCase
+import asyncio
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.contrib import admin
+from django.db import router
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat, LPad
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from taskmanager.testing import QueryBudgetMixin
+from .events import Broker, Event, LocalBackend
+from .models import Task, Category, UserShard
+from .sharding import ashard_for_user, get_cache, pin_shard, shard_for_user
+from .streams import RETRY_MS, _event_stream
 
 # Create your tests here.
+
+# Size of the seeded fixture: every user gets the same number of rows, so
+# a route that scans beyond the current user's rows blows its budget
+USERS = 10
+CATEGORIES_PER_USER = 10
+TASKS_PER_USER = 500
+TOTAL_TASKS = USERS * TASKS_PER_USER
+# One of the first user's tasks gets this many children, each with as many children
+SUBTASK_FANOUT = 3
+
+
+class TaskRouteBudgetTests(QueryBudgetMixin, TestCase):
+    """
+    Query count and rows-scanned budgets for every route in tasks/urls.py.
+
+    A failing budget means a change added queries (e.g. per-row lookups)
+    or lost an index; the failure message shows the offending SQL.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        today = timezone.now().date()
+        now = timezone.now()
+
+        cls.users = [
+            User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='pass12345')
+            for i in range(USERS)
+        ]
+
+        categories = Category.objects.bulk_create([
+            Category(name=f'Category {i}', user=user)
+            for user in cls.users
+            for i in range(CATEGORIES_PER_USER)
+        ])
+        categories_by_user = {}
+        for category in categories:
+            categories_by_user.setdefault(category.user_id, []).append(category)
+
+        # Mix of overdue, upcoming, undated and completed tasks
+        tasks = []
+        for user in cls.users:
+            user_categories = categories_by_user[user.pk]
+            for i in range(TASKS_PER_USER):
+                completed = i % 4 == 0
+                tasks.append(Task(
+                    title=f'Task {i}',
+                    description=f'Description of task {i} ' * 5,
+                    priority=['low', 'medium', 'high'][i % 3],
+                    status='completed' if completed else 'pending',
+                    completed_at=now if completed else None,
+                    due_date=None if i % 5 == 0 else today + timedelta(days=i % 60 - 20),
+                    category=user_categories[i % CATEGORIES_PER_USER] if i % 2 else None,
+                    user=user,
+                ))
+        Task.objects.bulk_create(tasks)
+
+        # bulk_create skips save(), so give every task its top-level path
+        Task.objects.update(path=Concat(
+            LPad(Cast('id', CharField()), Task.PATH_SEGMENT_DIGITS, Value('0')), Value('/'),
+            output_field=CharField()
+        ))
+
+        # A two-level subtree under the first user's second task (the
+        # first one, a completed top-level task, is used by the CRUD tests)
+        user_tasks = list(Task.objects.filter(user=cls.users[0]).order_by('id')[1:])
+        cls.root = user_tasks[0]
+        children = user_tasks[1:1 + SUBTASK_FANOUT]
+        grandchildren = user_tasks[1 + SUBTASK_FANOUT:1 + SUBTASK_FANOUT * (SUBTASK_FANOUT + 1)]
+        for i, child in enumerate(children):
+            child.move_to(cls.root)
+            for grandchild in grandchildren[i * SUBTASK_FANOUT:(i + 1) * SUBTASK_FANOUT]:
+                grandchild.move_to(child)
+        cls.root.refresh_from_db()
+
+        cls.analyze_database()
+
+    def setUp(self):
+        self.user = self.users[0]
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.task = Task.objects.filter(user=self.user, status='completed').first()
+        self.category = Category.objects.filter(user=self.user).first()
+
+    # Task list, search and ordering
+
+    def test_list(self):
+        with self.assertQueryBudget(queries=1, rows=TASKS_PER_USER):
+            response = self.client.get('/api/tasks/tasks/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), TASKS_PER_USER)
+
+    def test_list_expand_category(self):
+        # Categories are joined by primary key, one row per lookup
+        with self.assertQueryBudget(queries=1, rows=TASKS_PER_USER + 1):
+            response = self.client.get('/api/tasks/tasks/?expand=category')
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_sparse_fields(self):
+        with self.assertQueryBudget(queries=1, rows=TASKS_PER_USER):
+            response = self.client.get('/api/tasks/tasks/?fields=id,title,status')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data[0]), {'id', 'title', 'status'})
+
+    def test_search(self):
+        with self.assertQueryBudget(queries=1, rows=TASKS_PER_USER):
+            response = self.client.get('/api/tasks/tasks/?search=Task 1')
+        self.assertEqual(response.status_code, 200)
+
+    def test_ordering(self):
+        with self.assertQueryBudget(queries=1, rows=TASKS_PER_USER):
+            response = self.client.get('/api/tasks/tasks/?ordering=due_date')
+        self.assertEqual(response.status_code, 200)
+
+    # Task CRUD
+
+    def test_create(self):
+        data = {'title': 'New task', 'category_id': self.category.pk}
+        # The INSERT, then the path that embeds the new id
+        with self.assertQueryBudget(queries=3, rows=1):
+            response = self.client.post('/api/tasks/tasks/', data, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_retrieve(self):
+        with self.assertQueryBudget(queries=2, rows=2):
+            response = self.client.get(f'/api/tasks/tasks/{self.task.pk}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_update(self):
+        with self.assertQueryBudget(queries=3, rows=2):
+            response = self.client.patch(f'/api/tasks/tasks/{self.task.pk}/', {'title': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_sparse_fields(self):
+        # ?fields= trims the response but not the accepted input
+        with self.assertQueryBudget(queries=3, rows=2):
+            response = self.client.patch(
+                f'/api/tasks/tasks/{self.task.pk}/?fields=id', {'title': 'Patched'}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'id': self.task.pk})
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.title, 'Patched')
+
+    def test_delete(self):
+        # Lookups, the locked re-read of the rollups, then the DELETE
+        with self.assertQueryBudget(queries=4, rows=3):
+            response = self.client.delete(f'/api/tasks/tasks/{self.task.pk}/')
+        self.assertEqual(response.status_code, 204)
+
+    # Custom task actions
+
+    def test_overdue(self):
+        with self.assertQueryBudget(queries=1, rows=TASKS_PER_USER):
+            response = self.client.get('/api/tasks/tasks/overdue/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data)
+
+    def test_completed(self):
+        with self.assertQueryBudget(queries=1, rows=TASKS_PER_USER):
+            response = self.client.get('/api/tasks/tasks/completed/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data)
+
+    def test_pending(self):
+        with self.assertQueryBudget(queries=1, rows=TASKS_PER_USER):
+            response = self.client.get('/api/tasks/tasks/pending/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data)
+
+    def test_incomplete(self):
+        with self.assertQueryBudget(queries=2, rows=1):
+            response = self.client.patch(f'/api/tasks/tasks/{self.task.pk}/incomplete/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_agenda(self):
+        with self.assertQueryBudget(queries=1, rows=TASKS_PER_USER):
+            response = self.client.get('/api/tasks/tasks/agenda/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['days'])
+
+    def test_agenda_counts_only(self):
+        with self.assertQueryBudget(queries=1, rows=TASKS_PER_USER):
+            response = self.client.get('/api/tasks/tasks/agenda/?counts_only=true')
+        self.assertEqual(response.status_code, 200)
+
+    def test_dashboard(self):
+        # One ranked query for all buckets and counts, one for categories
+        with self.assertQueryBudget(queries=2, rows=TASKS_PER_USER + CATEGORIES_PER_USER):
+            response = self.client.get('/api/tasks/tasks/dashboard/?expand=category')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['categories']), CATEGORIES_PER_USER)
+        self.assertEqual(
+            response.data['counts']['pending'] + response.data['counts']['completed'],
+            TASKS_PER_USER
+        )
+
+    # Subtasks
+
+    def test_list_subtasks(self):
+        # One more query for all nested subtasks, whatever their number
+        with self.assertQueryBudget(queries=2, rows=2 * TASKS_PER_USER):
+            response = self.client.get('/api/tasks/tasks/?subtasks=2')
+        self.assertEqual(response.status_code, 200)
+        root = next(task for task in response.data if task['id'] == self.root.pk)
+        self.assertEqual(len(root['subtasks']), SUBTASK_FANOUT)
+        self.assertEqual(len(root['subtasks'][0]['subtasks']), SUBTASK_FANOUT)
+
+    def test_subtree(self):
+        # The subtree is a range on (user, path); the row estimate only
+        # counts the user prefix of the index
+        with self.assertQueryBudget(queries=3, rows=TASKS_PER_USER + 2):
+            response = self.client.get(f'/api/tasks/tasks/{self.root.pk}/subtree/')
+        self.assertEqual(response.status_code, 200)
+        rollup = response.data['rollup']
+        self.assertEqual(rollup['total'], SUBTASK_FANOUT * (SUBTASK_FANOUT + 1))
+        self.assertEqual(rollup['total'], self.root.descendant_count)
+        self.assertEqual(rollup['completed'], self.root.completed_descendant_count)
+
+    def test_move(self):
+        target = Task.objects.filter(user=self.user, parent=None).exclude(pk=self.root.pk).last()
+        # Lookups, the locked re-reads of both tree positions, then one
+        # statement each for the depth check, the path rewrite, the parent
+        # and the rollups, whatever the subtree size
+        with self.assertQueryBudget(queries=9):
+            response = self.client.post(
+                f'/api/tasks/tasks/{self.root.pk}/move/', {'parent_id': target.pk}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+
+        target.refresh_from_db()
+        root = Task.objects.get(pk=self.root.pk)
+        self.assertEqual(root.parent_id, target.pk)
+        self.assertTrue(root.path.startswith(target.path))
+        self.assertEqual(target.descendant_count, root.descendant_count + 1)
+        self.assertEqual(root.descendants().count(), root.descendant_count)
+
+    def test_delete_subtree(self):
+        # Subtasks of every level go in one range query
+        with self.assertQueryBudget(queries=6):
+            response = self.client.delete(f'/api/tasks/tasks/{self.root.pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Task.objects.filter(path__startswith=self.root.path).exists())
+
+    def test_move_under_own_subtask(self):
+        child = self.root.descendants().first()
+        response = self.client.post(f'/api/tasks/tasks/{self.root.pk}/move/', {'parent_id': child.pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    # Category CRUD
+
+    def test_category_list(self):
+        with self.assertQueryBudget(queries=1, rows=CATEGORIES_PER_USER):
+            response = self.client.get('/api/tasks/categories/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), CATEGORIES_PER_USER)
+
+    def test_category_create(self):
+        with self.assertQueryBudget(queries=1, rows=1):
+            response = self.client.post('/api/tasks/categories/', {'name': 'New category'}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_category_retrieve(self):
+        with self.assertQueryBudget(queries=2, rows=2):
+            response = self.client.get(f'/api/tasks/categories/{self.category.pk}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_category_update(self):
+        with self.assertQueryBudget(queries=3, rows=2):
+            response = self.client.patch(
+                f'/api/tasks/categories/{self.category.pk}/', {'color': '#ff0000'}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_category_delete(self):
+        # Includes the UPDATE clearing the category on its tasks
+        with self.assertQueryBudget(queries=4, rows=2):
+            response = self.client.delete(f'/api/tasks/categories/{self.category.pk}/')
+        self.assertEqual(response.status_code, 204)
+
+    # Async read endpoints (tasks/async_views.py). They authenticate
+    # through the session, which adds the session and user lookups
+
+    def async_get(self, path):
+        return async_to_sync(self.async_client.get)(path)
+
+    def test_async_list(self):
+        self.async_client.force_login(self.user)
+        with self.assertQueryBudget(queries=3, rows=TASKS_PER_USER + 2):
+            response = self.async_get('/api/tasks/async/tasks/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), TASKS_PER_USER)
+
+    def test_async_pending(self):
+        self.async_client.force_login(self.user)
+        with self.assertQueryBudget(queries=3, rows=TASKS_PER_USER + 2):
+            response = self.async_get('/api/tasks/async/tasks/pending/?fields=id,status')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), self.client.get('/api/tasks/tasks/pending/?fields=id,status').json())
+
+    def test_async_category_list(self):
+        self.async_client.force_login(self.user)
+        with self.assertQueryBudget(queries=3, rows=CATEGORIES_PER_USER + 2):
+            response = self.async_get('/api/tasks/async/categories/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), CATEGORIES_PER_USER)
+
+    def test_async_shard_lookup(self):
+        # The shard is looked up with ashard_for_user(), never synchronously on the event loop
+        self.async_client.force_login(self.user)
+        with mock.patch('tasks.models.shard_for_user', side_effect=AssertionError("sync shard lookup")):
+            tasks = self.async_get('/api/tasks/async/tasks/?subtasks=1&expand=category')
+            categories = self.async_get('/api/tasks/async/categories/')
+        self.assertEqual((tasks.status_code, categories.status_code), (200, 200))
+
+    def test_async_requires_authentication(self):
+        response = self.async_get('/api/tasks/async/tasks/')
+        self.assertEqual(response.status_code, 403)
+
+    # The live feed at /api/tasks/stream/ is a long-lived stream; only its
+    # refusal outside ASGI is covered here
+
+    def test_stream_requires_asgi(self):
+        with self.assertQueryBudget(queries=0):
+            response = self.client.get('/api/tasks/stream/')
+        self.assertEqual(response.status_code, 501)
+
+
+class TaskTreeTests(TestCase):
+    """Tree columns kept by the tree methods when tasks are saved, moved or deleted from stale instances."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='planner', password='pass12345')
+        cls.parent = Task.objects.create(title='Parent', user=cls.user)
+        Task.objects.create(title='Child', user=cls.user, parent=cls.parent)
+
+    def test_stale_save_keeps_rollups(self):
+        parent = Task.objects.get(pk=self.parent.pk)
+        Task.objects.create(title='Second child', user=self.user, parent=Task.objects.get(pk=self.parent.pk))
+
+        parent.title = 'Renamed'
+        parent.save()
+        parent.refresh_from_db()
+        self.assertEqual((parent.title, parent.descendant_count), ('Renamed', 2))
+
+    def test_stale_save_keeps_position(self):
+        child = Task.objects.get(parent=self.parent)
+        Task.objects.get(pk=child.pk).move_to(None)
+
+        child.status = 'completed'
+        child.save()
+        child.refresh_from_db()
+        self.assertEqual((child.parent_id, child.depth, child.path), (None, 0, Task.path_segment(child.pk)))
+        self.assertEqual(child.status, 'completed')
+
+    def test_stale_delete_removes_subtasks(self):
+        # self.parent was loaded before its child was added
+        grandparent = Task.objects.create(title='Grandparent', user=self.user)
+        Task.objects.get(pk=self.parent.pk).move_to(grandparent)
+
+        self.parent.delete()
+        grandparent.refresh_from_db()
+        self.assertEqual(list(Task.objects.filter(user=self.user)), [grandparent])
+        self.assertEqual((grandparent.descendant_count, grandparent.completed_descendant_count), (0, 0))
+
+    def test_stale_move_keeps_rollups(self):
+        target = Task.objects.create(title='Target', user=self.user)
+        Task.objects.filter(parent=self.parent).update(status='completed')
+        Task.objects.filter(pk=self.parent.pk).update(completed_descendant_count=1)
+
+        self.parent.move_to(target)
+        target.refresh_from_db()
+        self.assertEqual((target.descendant_count, target.completed_descendant_count), (2, 1))
+
+        self.parent.move_to(None)
+        target.refresh_from_db()
+        self.assertEqual((target.descendant_count, target.completed_descendant_count), (0, 0))
+
+
+class TaskAdminTests(TestCase):
+    """The task changelist, its prefix search and the bulk actions."""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='pass12345')
+        cls.owner = User.objects.create_user(username='owner', email='owner@example.com', password='pass12345')
+        cls.parent = Task.objects.create(title='Parent', user=cls.owner)
+        cls.children = [Task.objects.create(title=f'Child {i}', user=cls.owner, parent=cls.parent) for i in range(2)]
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_changelist_search(self):
+        response = self.client.get('/admin/tasks/task/', {'q': 'Chi'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({task.title for task in response.context['cl'].result_list}, {'Child 0', 'Child 1'})
+
+        # Prefixes are matched case-sensitively
+        response = self.client.get('/admin/tasks/task/', {'q': 'chi'})
+        self.assertFalse(response.context['cl'].result_list)
+
+    def test_search_uses_index(self):
+        queryset, _ = admin.site.get_model_admin(Task).get_search_results(None, Task.objects.all(), 'Chi')
+        self.assertIn('USING INDEX task_title_idx', queryset.explain())
+
+    def test_parent_autocomplete(self):
+        response = self.client.get('/admin/autocomplete/', {
+            'app_label': 'tasks', 'model_name': 'task', 'field_name': 'parent', 'term': 'Par',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['id'] for result in response.json()['results']], [str(self.parent.pk)])
+
+    def run_action(self, name, tasks):
+        with mock.patch('tasks.admin.publish_reset') as publish_reset, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/admin/tasks/task/', {
+                'action': name, '_selected_action': [task.pk for task in tasks],
+            })
+        self.assertEqual(response.status_code, 302)
+        # Bulk updates publish no per-task events, the owner's clients refetch
+        publish_reset.assert_called_once_with(self.owner.pk)
+
+    def test_mark_completed(self):
+        self.run_action('mark_completed', self.children)
+        self.assertFalse(Task.objects.filter(parent=self.parent, status='pending').exists())
+        self.parent.refresh_from_db()
+        self.assertEqual((self.parent.descendant_count, self.parent.completed_descendant_count), (2, 2))
+
+    def test_archive(self):
+        self.run_action('archive', [self.parent])
+        self.parent.refresh_from_db()
+        self.assertIsNotNone(self.parent.archived_at)
+        self.assertFalse(Task.objects.filter(parent=self.parent, archived_at__isnull=False).exists())
+
+
+@override_settings(TASK_SHARDS=['default', 'other'])
+class ShardLookupTests(TestCase):
+    """shard_for_user() and ashard_for_user() against the assignment table and its cache."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='sharded', password='pass12345')
+
+    def setUp(self):
+        get_cache().clear()
+
+    def test_assignment_is_stored_and_cached(self):
+        # get_or_create(): the SELECT, then the INSERT inside a savepoint
+        with self.assertNumQueries(4):
+            shard = shard_for_user(self.user.pk)
+        self.assertEqual(UserShard.objects.get(user=self.user).shard, shard)
+        with self.assertNumQueries(0):
+            self.assertEqual(shard_for_user(self.user.pk), shard)
+
+    def test_verify_reads_the_assignment(self):
+        shard_for_user(self.user.pk)
+        UserShard.objects.filter(user=self.user).update(shard='moved')
+        self.assertNotEqual(shard_for_user(self.user.pk), 'moved')
+        self.assertEqual(shard_for_user(self.user.pk, verify=True), 'moved')
+        # The cache is refreshed along the way
+        self.assertEqual(shard_for_user(self.user.pk), 'moved')
+
+    def test_async_version_agrees(self):
+        shard = async_to_sync(ashard_for_user)(self.user.pk)
+        self.assertEqual(UserShard.objects.get(user=self.user).shard, shard)
+        get_cache().clear()
+        self.assertEqual(shard_for_user(self.user.pk), shard)
+
+        UserShard.objects.filter(user=self.user).update(shard='moved')
+        self.assertEqual(async_to_sync(ashard_for_user)(self.user.pk, verify=True), 'moved')
+
+
+@override_settings(TASK_SHARDS=['default', 'other'])
+class ShardRoutingTests(TestCase):
+    """TaskShardRouter and the rebalance_user command, with two shards."""
+
+    databases = {'default', 'other'}
+
+    @classmethod
+    def setUpClass(cls):
+        # The test runner migrated 'other' while it was not a shard, which
+        # only recorded the tasks migrations; apply them for real
+        with override_settings(TASK_SHARDS=['default', 'other']):
+            call_command('migrate', 'tasks', 'zero', database='other', fake=True, verbosity=0)
+            call_command('migrate', 'tasks', database='other', verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='mover', email='mover@example.com', password='pass12345')
+        cls.neighbour = User.objects.create_user(
+            username='neighbour', email='neighbour@example.com', password='pass12345'
+        )
+        UserShard.objects.create(user=cls.user, shard='default')
+        UserShard.objects.create(user=cls.neighbour, shard='other')
+
+        # Ids on 'other' are ahead, so moved rows cannot keep their old ones
+        cls.neighbour_tasks = [Task.objects.create(user=cls.neighbour, title=f'Task {i}') for i in range(3)]
+        cls.category = Category.objects.create(user=cls.user, name='Work')
+        cls.parent = Task.objects.create(user=cls.user, title='Parent', category=cls.category)
+        cls.child = Task.objects.create(user=cls.user, title='Child', parent=cls.parent, status='completed')
+
+    def setUp(self):
+        get_cache().clear()
+
+    def test_rows_follow_the_assignment(self):
+        self.assertEqual((self.parent._state.db, self.neighbour_tasks[0]._state.db), ('default', 'other'))
+        self.assertEqual(list(Task.objects.for_user(self.neighbour).order_by('id')), self.neighbour_tasks)
+        self.assertFalse(Task.objects.using('default').filter(user=self.neighbour).exists())
+        # Related lookups follow the instance they start from
+        self.assertEqual(list(self.neighbour.tasks.order_by('id')), self.neighbour_tasks)
+        self.assertFalse(router.allow_relation(self.parent, self.neighbour_tasks[0]))
+
+    def test_query_without_hint(self):
+        with self.assertLogs('tasks.routers', 'WARNING'):
+            list(Task.objects.all())
+        with pin_shard('other'), self.assertNoLogs('tasks.routers'):
+            self.assertEqual(Task.objects.count(), len(self.neighbour_tasks))
+
+    def test_allow_migrate(self):
+        self.assertTrue(router.allow_migrate_model('other', Task))
+        self.assertFalse(router.allow_migrate_model('other', UserShard))
+        self.assertFalse(router.allow_migrate_model('other', get_user_model()))
+
+    def test_rebalance_user(self):
+        with mock.patch('tasks.management.commands.rebalance_user.publish_reset') as publish_reset:
+            call_command('rebalance_user', 'mover', 'other', stdout=StringIO())
+        publish_reset.assert_called_once_with(self.user.pk)
+
+        self.assertEqual(UserShard.objects.get(user=self.user).shard, 'other')
+        self.assertEqual(shard_for_user(self.user.pk), 'other')
+        self.assertFalse(Task.objects.using('default').filter(user=self.user).exists())
+        self.assertFalse(Category.objects.using('default').filter(user=self.user).exists())
+
+        # New ids, with parents, paths and categories pointing at them
+        tasks = {task.title: task for task in Task.objects.for_user(self.user)}
+        parent, child = tasks['Parent'], tasks['Child']
+        self.assertNotIn(parent.pk, [task.pk for task in self.neighbour_tasks])
+        self.assertEqual(parent.category, Category.objects.for_user(self.user).get())
+        self.assertEqual(child.parent_id, parent.pk)
+        self.assertEqual(child.path, Task.path_segment(parent.pk) + Task.path_segment(child.pk))
+        self.assertEqual((parent.descendant_count, parent.completed_descendant_count), (1, 1))
+        self.assertEqual(list(parent.descendants()), [child])
+
+
+class LiveFeedTests(TestCase):
+    """Broker buffering, backpressure and resume, the SSE stream, and the signals publishing to it."""
+
+    def make_broker(self, **kwargs):
+        return Broker(LocalBackend(), **{'buffer_size': 3, 'queue_size': 2, **kwargs})
+
+    def publish(self, broker, user_id, count):
+        events = [Event(user_id, 'task', 'updated', i) for i in range(count)]
+        for event in events:
+            broker.publish(event)
+        return events
+
+    async def collect(self, stream, count):
+        return [await anext(stream) for _ in range(count)]
+
+    # Broker
+
+    async def test_delivery(self):
+        broker = self.make_broker()
+        subscription, missed = broker.subscribe(1)
+        other, _ = broker.subscribe(2)
+        self.assertEqual(missed, [])
+        self.assertTrue(broker.has_subscribers(1))
+
+        event, = self.publish(broker, 1, 1)
+        self.assertIs(await subscription.get(timeout=1), event)
+        self.assertTrue(other.queue.empty())
+
+        subscription.close()
+        self.assertFalse(broker.has_subscribers(1))
+
+    async def test_resume(self):
+        broker = self.make_broker()
+        events = self.publish(broker, 1, 3)
+        subscription, missed = broker.subscribe(1, events[0].id)
+        self.assertEqual(missed, events[1:])
+        subscription.close()
+
+    async def test_resume_after_eviction(self):
+        broker = self.make_broker()
+        events = self.publish(broker, 1, 5)
+        # The buffer holds the last 3 events: replaying from the first would skip some
+        self.assertIsNone(broker.subscribe(1, events[0].id)[1])
+        self.assertEqual(broker.subscribe(1, events[1].id)[1], events[2:])
+
+    async def test_resume_unknown_id(self):
+        broker = self.make_broker()
+        self.publish(broker, 1, 1)
+        self.assertIsNone(broker.subscribe(1, 'otherboot-1')[1])
+        self.assertIsNone(broker.subscribe(1, 'garbage')[1])
+
+    async def test_history_is_bounded_by_users(self):
+        broker = self.make_broker(max_users=2)
+        first = self.publish(broker, 1, 1)
+        second = self.publish(broker, 2, 2)
+        self.publish(broker, 1, 1)
+        self.publish(broker, 3, 1)
+
+        # User 2 was the least recently active, so their buffer is gone
+        self.assertEqual(set(broker._history), {1, 3})
+        self.assertIsNone(broker.subscribe(2, second[0].id)[1])
+        self.assertEqual(broker.subscribe(2, second[1].id)[1], [])
+        self.assertEqual(len(broker.subscribe(1, first[0].id)[1]), 1)
+
+        # A new buffer for user 2 cannot vouch for the events dropped before it
+        self.publish(broker, 2, 1)
+        self.assertIsNone(broker.subscribe(2, second[0].id)[1])
+
+    async def test_backpressure(self):
+        broker = self.make_broker()
+        subscription, _ = broker.subscribe(1)
+        self.publish(broker, 1, 3)
+        await asyncio.sleep(0)
+
+        # The backlog is dropped and the consumer is woken with None
+        self.assertTrue(subscription.overflowed)
+        self.assertIsNone(await subscription.get(timeout=1))
+
+    # Stream
+
+    async def test_stream_requires_authentication(self):
+        # Served over ASGI, so the request gets as far as authentication
+        response = await self.async_client.get('/api/tasks/stream/')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_stream_heartbeat(self):
+        broker = self.make_broker()
+        with mock.patch('tasks.streams.get_broker', return_value=broker):
+            stream = _event_stream(1, None, heartbeat=0.01)
+            self.assertEqual(await self.collect(stream, 2), [f'retry: {RETRY_MS}\n\n', ': heartbeat\n\n'])
+            await stream.aclose()
+        self.assertFalse(broker.has_subscribers(1))
+
+    async def test_stream_resume(self):
+        broker = self.make_broker()
+        events = self.publish(broker, 1, 3)
+        with mock.patch('tasks.streams.get_broker', return_value=broker):
+            stream = _event_stream(1, events[0].id, heartbeat=1)
+            sent = await self.collect(stream, 3)
+            await stream.aclose()
+        self.assertEqual(sent[1:], [event.to_sse() for event in events[1:]])
+
+    async def test_stream_reset(self):
+        broker = self.make_broker()
+        with mock.patch('tasks.streams.get_broker', return_value=broker):
+            stream = _event_stream(1, 'otherboot-1', heartbeat=1)
+            sent = await self.collect(stream, 2)
+            await stream.aclose()
+        self.assertEqual(sent[1], 'event: reset\ndata: {}\n\n')
+
+    async def test_stream_overflow(self):
+        broker = self.make_broker()
+        with mock.patch('tasks.streams.get_broker', return_value=broker):
+            stream = _event_stream(1, None, heartbeat=1)
+            await anext(stream)
+            self.publish(broker, 1, 3)
+            sent = [chunk async for chunk in stream]
+        self.assertEqual(sent, ['event: overflow\ndata: {}\n\n'])
+        self.assertFalse(broker.has_subscribers(1))
+
+    # Signals
+
+    def test_event_payload(self):
+        user = get_user_model().objects.create_user(username='listener', password='pass12345')
+        category = Category.objects.create(name='Work', user=user)
+        task = Task.objects.get(pk=Task.objects.create(title='Task', category=category, user=user).pk)
+
+        task.title = 'Renamed'
+        with mock.patch.object(Broker, 'has_subscribers', return_value=True), \
+                mock.patch('tasks.events.publish') as publish:
+            # The payload renders the category id without loading it
+            with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(1):
+                task.save()
+        user_id, model, action, object_id, data = publish.call_args.args
+        self.assertEqual((user_id, model, action, object_id), (user.pk, 'task', 'updated', task.pk))
+        self.assertEqual((data['title'], data['category']), ('Renamed', category.pk))
+
+    def test_subtask_created_event(self):
+        user = get_user_model().objects.create_user(username='nester', password='pass12345')
+        parent = Task.objects.create(title='Parent', user=user)
+        with mock.patch.object(Broker, 'has_subscribers', return_value=True), \
+                mock.patch('tasks.events.publish') as publish, self.captureOnCommitCallbacks(execute=True):
+            child = Task.objects.create(title='Child', user=user, parent=parent)
+        # Rendered once the subtask has its place in the tree
+        data = publish.call_args.args[4]
+        self.assertEqual((data['parent'], data['depth']), (parent.pk, 1))
+        self.assertEqual(child.path, parent.path + Task.path_segment(child.pk))
+
+    def test_move_events(self):
+        user = get_user_model().objects.create_user(username='mover', password='pass12345')
+        source = Task.objects.create(title='Source', user=user)
+        target = Task.objects.create(title='Target', user=user)
+        task = Task.objects.create(title='Task', user=user, parent=source)
+        subtask = Task.objects.create(title='Subtask', user=user, parent=task)
+
+        with mock.patch('tasks.events.publish') as publish, self.captureOnCommitCallbacks(execute=True):
+            Task.objects.get(pk=task.pk).move_to(target)
+        # The moved subtree and both ancestor chains
+        published = {call.args[1:4] for call in publish.call_args_list}
+        self.assertEqual(published, {('task', 'updated', pk) for pk in [source.pk, target.pk, task.pk, subtask.pk]})
+
+        with override_settings(TASK_EVENTS_MOVE_LIMIT=3), mock.patch('tasks.events.publish') as publish, \
+                self.captureOnCommitCallbacks(execute=True):
+            Task.objects.get(pk=task.pk).move_to(source)
+        publish.assert_called_once_with(user.pk, None, 'reset', None)
+
+    def test_event_without_subscribers(self):
+        user = get_user_model().objects.create_user(username='offline', password='pass12345')
+        with mock.patch('tasks.events.publish') as publish, self.captureOnCommitCallbacks(execute=True):
+            Task.objects.create(title='Task', user=user)
+        self.assertIsNone(publish.call_args.args[4])
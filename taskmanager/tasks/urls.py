@@ -1,7 +1,9 @@
-from django.urls import path, include
+from django.urls import path, re_path, include
 from rest_framework.routers import DefaultRouter
 
+from . import async_views
 from .views import TaskViewSet, CategoryViewSet
+from .streams import task_event_stream
 
 # Create a router instance
 router = DefaultRouter()
@@ -12,5 +14,10 @@ router.register(r'categories', CategoryViewSet, basename='category')
 
 # URL patterns
 urlpatterns = [
+    path('stream/', task_event_stream, name='task-stream'),  # Live change feed (SSE)
+    # Async versions of the read endpoints, for ASGI deployments
+    path('async/tasks/', async_views.task_list, name='async-task-list'),
+    re_path(r'^async/tasks/(?P<name>overdue|completed|pending)/$', async_views.task_status_list, name='async-task-status'),
+    path('async/categories/', async_views.category_list, name='async-category-list'),
     path('', include(router.urls)),
 ]
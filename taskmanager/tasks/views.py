@@ -1,10 +1,17 @@
+from datetime import timedelta
+from itertools import groupby
+
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.db.models import Q, Count, F, Case, When, Value, BooleanField, Window
+from django.db.models.functions import RowNumber, Substr
 
 from .models import Task, Category
 from .serializers import TaskSerializer, TaskUpdateSerializer, CategorySerializer
@@ -28,6 +35,10 @@ class CategoryViewSet(viewsets.ModelViewSet):
     # User must be authenticated AND must own the category
     permission_classes = [IsAuthenticated, IsCategoryOwner]
 
+    # Shard holding the user's rows, when the caller has looked it up
+    # already (the async views); looked up by for_user() otherwise
+    shard = None
+
     def get_queryset(self):
         """
         Override default queryset.
@@ -35,8 +46,9 @@ class CategoryViewSet(viewsets.ModelViewSet):
         This ensures:
         - Users can ONLY see their own categories
         - Prevents data leakage between users
+        - Queries go to the shard holding the user's data
         """
-        return Category.objects.filter(user=self.request.user)
+        return Category.objects.for_user(self.request.user, shard=self.shard)
 
     def perform_create(self, serializer):
         """
@@ -55,6 +67,7 @@ class TaskViewSet(viewsets.ModelViewSet):
     - Search
     - Ordering
     - Custom task actions (overdue, completed, pending, incomplete)
+    - Subtasks (subtree, move, nesting with ?subtasks=N)
     """
 
     # Serializer that defines how Task objects are converted to JSON
@@ -63,6 +76,10 @@ class TaskViewSet(viewsets.ModelViewSet):
     # Only authenticated users who own the task can access it
     permission_classes = [IsAuthenticated, IsTaskOwner]
 
+    # Shard holding the user's rows, when the caller has looked it up
+    # already (the async views); looked up by for_user() otherwise
+    shard = None
+
     # Enable search and ordering functionality
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
 
@@ -75,14 +92,118 @@ class TaskViewSet(viewsets.ModelViewSet):
     # Default ordering (newest tasks first)
     ordering = ['-created_at']
 
+    # Read-only list actions whose queries load only the requested fields
+    sparse_actions = ['list', 'overdue', 'completed', 'pending', 'agenda', 'dashboard']
+
+    # Default and maximum number of days covered by the agenda endpoint
+    agenda_default_days = 30
+    agenda_max_days = 366
+
+    # Default and maximum number of tasks per bucket on the dashboard
+    dashboard_default_limit = 5
+    dashboard_max_limit = 50
+
+    # Actions that can nest subtasks with ?subtasks=N
+    subtask_actions = ['list', 'retrieve', 'overdue', 'completed', 'pending']
+
     def get_queryset(self):
         """
         Return ONLY tasks belonging to the logged-in user.
 
         This is the most important security layer:
         - Users cannot view or modify other users' tasks
+        - Queries go to the shard holding the user's data
+
+        For list actions the query is narrowed to what the response
+        renders: only the ?fields= columns are loaded and the category
+        join is made only for ?expand=category.
+        """
+        queryset = Task.objects.for_user(self.request.user, shard=self.shard)
+
+        if self.action in self.sparse_actions:
+            columns, related = TaskSerializer.get_query_options(self.request)
+            if related:
+                queryset = queryset.select_related(*related)
+            if columns is not None:
+                queryset = queryset.only(*columns)
+
+        return queryset
+
+    def get_serializer_context(self):
+        # The serializer limits category_id and parent_id to the same shard
+        context = super().get_serializer_context()
+        context['shard'] = self.shard
+        return context
+
+    def get_serializer(self, *args, **kwargs):
         """
-        return Task.objects.filter(user=self.request.user)
+        Nest subtasks when ?subtasks=N is requested.
+
+        All subtasks down to N levels below the serialized tasks are loaded
+        with one extra query, whatever the number of tasks or levels.
+        """
+        levels = self.get_subtask_levels()
+        if levels and args and args[0] is not None:
+            tasks = list(args[0]) if kwargs.get('many') else [args[0]]
+            subtasks = self.get_subtasks_queryset(tasks, levels)
+            kwargs['context'] = self.get_subtask_context(subtasks, levels)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_subtask_levels(self):
+        """Parse ?subtasks=N, the number of subtask levels to nest (0 for none)."""
+        value = self.request.query_params.get('subtasks')
+        if not value or self.action not in self.subtask_actions:
+            return 0
+
+        try:
+            levels = int(value)
+        except ValueError:
+            raise ValidationError({"subtasks": "Enter a whole number."})
+        return max(0, min(levels, Task.MAX_DEPTH))
+
+    def get_subtasks_queryset(self, tasks, levels):
+        """
+        Return the subtasks of the given tasks down to `levels` levels
+        below each of them, as a single query.
+        """
+        segments_by_depth = {}
+        for task in tasks:
+            segments_by_depth.setdefault(task.depth, set()).add(Task.path_segment(task.pk))
+        if not segments_by_depth:
+            return Task.objects.none()
+
+        # Descendants of a task at depth d carry its segment at position d
+        # of their path; one condition per distinct depth of the roots
+        width = Task.PATH_SEGMENT_DIGITS + 1
+        condition = Q()
+        for depth, segments in segments_by_depth.items():
+            condition |= Q(
+                Q(depth__gt=depth, depth__lte=depth + levels),
+                **{f'path_d{depth}__in': segments}
+            )
+
+        queryset = self.get_queryset().annotate(**{
+            f'path_d{depth}': Substr('path', depth * width + 1, width)
+            for depth in segments_by_depth
+        })
+        return queryset.filter(condition).order_by('path')
+
+    def get_subtask_context(self, subtasks, levels):
+        """Serializer context nesting the given subtasks `levels` levels deep."""
+        context = self.get_serializer_context()
+        context['subtasks'] = {}
+        for subtask in subtasks:
+            context['subtasks'].setdefault(subtask.parent_id, []).append(subtask)
+        context['subtask_levels'] = levels
+        return context
+
+    def get_status_queryset(self, name):
+        """Queryset behind the overdue, completed and pending actions."""
+        queryset = self.get_queryset()
+        if name == 'overdue':
+            # Pending tasks whose due date has passed
+            return queryset.filter(due_date__lt=timezone.now().date(), status='pending')
+        return queryset.filter(status=name)
 
     def perform_create(self, serializer):
         """
@@ -130,14 +251,7 @@ class TaskViewSet(viewsets.ModelViewSet):
         Returns all pending tasks whose due date has passed.
         """
 
-        # Get today's date
-        today = timezone.now().date()
-
-        # Filter overdue AND pending tasks
-        overdue_tasks = self.get_queryset().filter(
-            due_date__lt=today,
-            status='pending'
-        )
+        overdue_tasks = self.get_status_queryset('overdue')
 
         # Apply pagination if enabled
         page = self.paginate_queryset(overdue_tasks)
@@ -158,7 +272,7 @@ class TaskViewSet(viewsets.ModelViewSet):
         Returns all completed tasks.
         """
 
-        completed_tasks = self.get_queryset().filter(status='completed')
+        completed_tasks = self.get_status_queryset('completed')
 
         page = self.paginate_queryset(completed_tasks)
         if page is not None:
@@ -177,7 +291,7 @@ class TaskViewSet(viewsets.ModelViewSet):
         Returns all pending tasks.
         """
 
-        pending_tasks = self.get_queryset().filter(status='pending')
+        pending_tasks = self.get_status_queryset('pending')
 
         page = self.paginate_queryset(pending_tasks)
         if page is not None:
@@ -219,4 +333,238 @@ class TaskViewSet(viewsets.ModelViewSet):
                 "message": "Task marked as incomplete.",
                 "task": serializer.data
             }
-        )
\ No newline at end of file
+        )
+
+    @action(detail=True, methods=['get'])
+    def subtree(self, request, pk=None):
+        """
+        Custom endpoint:
+        GET /api/tasks/{id}/subtree/
+
+        Returns the task with all its subtasks nested, and a completion
+        rollup of the subtree. The subtree is read with a single range
+        query on the (user, path) index.
+        """
+
+        task = self.get_object()
+
+        descendants = list(task.descendants().order_by('path'))
+        total = len(descendants)
+        completed = sum(subtask.status == 'completed' for subtask in descendants)
+
+        context = self.get_subtask_context(descendants, Task.MAX_DEPTH)
+        serializer = TaskSerializer(task, context=context)
+
+        return Response(
+            {
+                "rollup": {
+                    "total": total,
+                    "completed": completed,
+                    "pending": total - completed,
+                    "percent_completed": round(completed * 100 / total) if total else None
+                },
+                "task": serializer.data
+            }
+        )
+
+    @action(detail=True, methods=['post'])
+    def move(self, request, pk=None):
+        """
+        Custom endpoint:
+        POST /api/tasks/{id}/move/
+
+        Moves the task and all its subtasks under another task, given as
+        {"parent_id": <id>}, or to the top level with {"parent_id": null}.
+        Runs a constant number of queries whatever the subtree size.
+        """
+
+        task = self.get_object()
+
+        if 'parent_id' not in request.data:
+            return Response(
+                {"message": "parent_id is required."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Validates that the parent exists and belongs to the user
+        serializer = self.get_serializer(task, data={'parent_id': request.data['parent_id']}, partial=True)
+        serializer.is_valid(raise_exception=True)
+
+        # Only the tree columns change, the rest of the row is not rewritten
+        try:
+            task.move_to(serializer.validated_data['parent'])
+        except DjangoValidationError as exc:
+            raise ValidationError({"parent_id": exc.messages})
+
+        return Response(
+            {
+                "message": "Task moved.",
+                "task": self.get_serializer(task).data
+            }
+        )
+
+    def _get_date_param(self, name):
+        """
+        Parse an optional YYYY-MM-DD query parameter.
+
+        Raises a 400 validation error when the value is present but invalid.
+        """
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+
+        try:
+            parsed = parse_date(value)
+        except ValueError:
+            parsed = None
+
+        if parsed is None:
+            raise ValidationError({name: "Enter a valid date in YYYY-MM-DD format."})
+        return parsed
+
+    @action(detail=False, methods=['get'])
+    def agenda(self, request):
+        """
+        Custom endpoint:
+        GET /api/tasks/agenda/?start=YYYY-MM-DD&end=YYYY-MM-DD
+
+        Returns tasks due within the date range (inclusive), grouped by day
+        with a per-day count. Pass ?counts_only=true to get just the counts
+        (heatmap mode) without task bodies.
+
+        Both modes are served by a single range query over the
+        (user, due_date) index.
+        """
+
+        start = self._get_date_param('start')
+        end = self._get_date_param('end')
+
+        # Default to a window starting today
+        start = start or timezone.now().date()
+        end = end or start + timedelta(days=self.agenda_default_days - 1)
+
+        if end < start:
+            return Response(
+                {"message": "end must not be before start."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if (end - start).days >= self.agenda_max_days:
+            return Response(
+                {"message": f"Date range cannot exceed {self.agenda_max_days} days."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        tasks_in_range = self.get_queryset().filter(due_date__range=(start, end))
+
+        counts_only = request.query_params.get('counts_only', '').lower() in ('1', 'true', 'yes')
+
+        if counts_only:
+            # Heatmap mode: aggregate in the database, no task bodies
+            rows = (
+                tasks_in_range
+                .values('due_date')
+                .annotate(count=Count('id'))
+                .order_by('due_date')
+            )
+            days = [{"date": row['due_date'], "count": row['count']} for row in rows]
+        else:
+            # Ordering matches the index so rows arrive already grouped by day.
+            # The day is annotated so grouping works even if due_date is not
+            # among the requested fields.
+            tasks_in_range = tasks_in_range.annotate(day=F('due_date')).order_by('due_date', 'id')
+            days = []
+            for due_date, day_tasks in groupby(tasks_in_range, key=lambda task: task.day):
+                serializer = self.get_serializer(list(day_tasks), many=True)
+                days.append({
+                    "date": due_date,
+                    "count": len(serializer.data),
+                    "tasks": serializer.data
+                })
+
+        return Response(
+            {
+                "start": start,
+                "end": end,
+                "total": sum(day['count'] for day in days),
+                "days": days
+            }
+        )
+
+    @action(detail=False, methods=['get'])
+    def dashboard(self, request):
+        """
+        Custom endpoint:
+        GET /api/tasks/dashboard/?limit=N
+
+        Returns everything the home screen needs in one response:
+        - the N newest overdue, pending and completed tasks
+        - the total count of each bucket
+        - the user's categories
+
+        Tasks and counts come from a single query (ranked with window
+        functions) and categories from a second one, which is also used
+        for ?expand=category instead of joining per task.
+        """
+
+        limit = request.query_params.get('limit', self.dashboard_default_limit)
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise ValidationError({"limit": "Enter a whole number."})
+        limit = max(1, min(limit, self.dashboard_max_limit))
+
+        today = timezone.now().date()
+
+        # Overdue tasks are also pending, so they are ranked in their own partition
+        tasks = (
+            self.get_queryset()
+            .select_related(None)
+            .annotate(
+                # Annotated so bucketing works whatever ?fields= loads
+                task_status=F('status'),
+                overdue_bucket=Case(
+                    When(status='pending', due_date__lt=today, then=Value(True)),
+                    default=Value(False),
+                    output_field=BooleanField()
+                ),
+            )
+            .annotate(
+                status_rank=Window(RowNumber(), partition_by=F('status'), order_by=F('created_at').desc()),
+                status_total=Window(Count('id'), partition_by=F('status')),
+                overdue_rank=Window(RowNumber(), partition_by=F('overdue_bucket'), order_by=F('created_at').desc()),
+                overdue_total=Window(Count('id'), partition_by=F('overdue_bucket')),
+            )
+            .filter(Q(status_rank__lte=limit) | Q(overdue_bucket=True, overdue_rank__lte=limit))
+            .order_by('-created_at')
+        )
+
+        categories = list(Category.objects.for_user(request.user))
+        categories_by_id = {category.pk: category for category in categories}
+        expand_category = 'category' in TaskSerializer.get_query_options(request)[1]
+
+        buckets = {'overdue': [], 'pending': [], 'completed': []}
+        counts = dict.fromkeys(buckets, 0)
+        for task in tasks:
+            if expand_category and task.category_id is not None:
+                # Reuse the category lookup instead of a join per task
+                task.category = categories_by_id.get(task.category_id)
+
+            if task.status_rank <= limit:
+                buckets[task.task_status].append(task)
+            counts[task.task_status] = task.status_total
+
+            if task.overdue_bucket:
+                counts['overdue'] = task.overdue_total
+                if task.overdue_rank <= limit:
+                    buckets['overdue'].append(task)
+
+        response = {
+            "counts": counts,
+            **{
+                name: self.get_serializer(bucket, many=True).data
+                for name, bucket in buckets.items()
+            },
+            "categories": CategorySerializer(categories, many=True).data
+        }
+        return Response(response)
@@ -1,5 +1,38 @@
 from django.contrib import admin
+from django.contrib.auth.admin import UserAdmin
+
+from taskmanager.pagination import ApproximateCountPaginator
+from taskmanager.search import PrefixSearchMixin
 from .models import CustomUser
 # Register your models here.
 
-admin.site.register(CustomUser)
\ No newline at end of file
+
+@admin.register(CustomUser)
+class CustomUserAdmin(PrefixSearchMixin, UserAdmin):
+    """
+    User admin with approximate counts and index-friendly search.
+
+    Built on UserAdmin, so passwords are hashed on creation and only
+    changed through the password form.
+    """
+    list_display = ['username', 'email', 'first_name', 'last_name', 'is_staff', 'is_active']
+    list_filter = ['is_staff', 'is_active']
+    # Case-sensitive prefixes, served by the unique indexes on username
+    # and email (see PrefixSearchMixin); also used by autocomplete widgets
+    # pointing at users
+    search_fields = ['username', 'email']
+    ordering = ['-id']
+
+    fieldsets = UserAdmin.fieldsets + (
+        ('Profile', {'fields': ('bio', 'profile_picture')}),
+    )
+    # Email and names are required on CustomUser
+    add_fieldsets = (
+        (None, {
+            'classes': ('wide',),
+            'fields': ('username', 'email', 'first_name', 'last_name', 'usable_password', 'password1', 'password2'),
+        }),
+    )
+
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
@@ -1,3 +1,104 @@
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
 from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from taskmanager.testing import QueryBudgetMixin
 
 # Create your tests here.
+
+# Number of seeded users; lookups must stay on the username/email indexes
+USERS = 1000
+
+
+class UserRouteBudgetTests(QueryBudgetMixin, TestCase):
+    """
+    Query count and rows-scanned budgets for every route in users/urls.py.
+
+    The failure message shows the offending SQL.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        password = make_password('pass12345')
+        User.objects.bulk_create([
+            User(username=f'user{i}', email=f'user{i}@example.com', password=password)
+            for i in range(USERS)
+        ])
+        cls.user = User.objects.get(username='user0')
+        cls.analyze_database()
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_register(self):
+        data = {
+            'username': 'newuser',
+            'email': 'newuser@example.com',
+            'first_name': 'New',
+            'last_name': 'User',
+            'password': 'Str0ng-passw0rd',
+            'password2': 'Str0ng-passw0rd',
+        }
+        # Savepoints around get_or_create count as queries
+        with self.assertQueryBudget(queries=8, rows=3):
+            response = self.client.post('/api/users/register/', data, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('token', response.data)
+
+    def test_login(self):
+        data = {'username': 'user0', 'password': 'pass12345'}
+        # Includes creating the session and the token
+        with self.assertQueryBudget(queries=13, rows=3):
+            response = self.client.post('/api/users/login/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('token', response.data)
+
+    def test_logout(self):
+        Token.objects.create(user=self.user)
+        self.client.force_authenticate(user=self.user)
+        with self.assertQueryBudget(queries=2, rows=1):
+            response = self.client.post('/api/users/logout/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Token.objects.filter(user=self.user).exists())
+
+
+class CustomUserAdminTests(TestCase):
+    """Users created and edited through the admin."""
+
+    def setUp(self):
+        admin = get_user_model().objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass12345'
+        )
+        self.client.force_login(admin)
+
+    def test_add_user_hashes_password(self):
+        response = self.client.post('/admin/users/customuser/add/', {
+            'username': 'staffer',
+            'email': 'staffer@example.com',
+            'first_name': 'Staff',
+            'last_name': 'Member',
+            'usable_password': 'true',
+            'password1': 'Str0ng-passw0rd',
+            'password2': 'Str0ng-passw0rd',
+        })
+        self.assertEqual(response.status_code, 302)
+        user = get_user_model().objects.get(username='staffer')
+        self.assertTrue(user.check_password('Str0ng-passw0rd'))
+
+    def test_password_is_not_editable(self):
+        user = get_user_model().objects.get(username='admin')
+        response = self.client.get(f'/admin/users/customuser/{user.pk}/change/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'name="password"')
+
+    def test_search_uses_indexes(self):
+        response = self.client.get('/admin/users/customuser/', {'q': 'adm'})
+        self.assertEqual([user.username for user in response.context['cl'].result_list], ['admin'])
+
+        User = get_user_model()
+        queryset, _ = admin.site.get_model_admin(User).get_search_results(None, User.objects.all(), 'adm')
+        self.assertNotIn('SCAN', queryset.explain())